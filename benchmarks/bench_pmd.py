@@ -0,0 +1,69 @@
+"""
+Benchmarks of the PMD hot paths.
+
+The classes follow the asv conventions: setup(*params) builds the state for each combination
+of params, then the time_* methods are timed. Run them with benchmarks/run.py.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "book", "ode", "ressources")
+)
+from PMD import PMD, GravityForce, MorseForce, distances  # noqa: E402
+
+SEED = 0
+
+
+def lattice(n, spacing=1.0, noise=0.05, seed=SEED):
+    """
+    Returns the positions of a square lattice of about n particles, slightly perturbed.
+    """
+    side = int(round(np.sqrt(n)))
+    rows, cols = np.meshgrid(np.arange(side), np.arange(side))
+    P = np.stack([cols.ravel(), rows.ravel()], axis=1) * spacing
+    return P + np.random.default_rng(seed).normal(0.0, noise, P.shape)
+
+
+class TimeDistances:
+    params = [[100, 300, 1000]]
+    param_names = ["n"]
+
+    def setup(self, n):
+        self.P = np.random.default_rng(SEED).normal(size=(n, 2))
+        self.out = (np.empty((n, n, 2)), np.empty((n, n)), np.empty((n, n, 2)))
+
+    def time_distances(self, n):
+        distances(self.P)
+
+    def time_distances_out(self, n):
+        distances(self.P, out=self.out)
+
+
+class TimeSolve:
+    params = [["gravity", "morse"], [64, 256], ["verlet", "odeint"]]
+    param_names = ["model", "n", "integrator"]
+    timeout = 300
+
+    def setup(self, model, n, integrator):
+        rng = np.random.default_rng(SEED)
+        if model == "gravity":
+            P = rng.normal(size=(n, 2))
+            V = rng.normal(scale=0.1, size=(n, 2))
+            force = GravityForce(G=1.0e-2)
+        else:
+            P = lattice(n, spacing=1.1)
+            V = rng.normal(scale=0.1, size=P.shape)
+            force = MorseForce(De=1.0, a=3.0, re=1.0, cutoff=3.0)
+        self.P, self.V = P, V
+        self.pmd = PMD(np.ones(len(P)), P, V, nk=100, integrator=integrator)
+        self.pmd.add_force(force)
+
+    def time_solve(self, model, n, integrator):
+        # 10 steps of 1e-3 from the initial state, so that every call integrates the same steps.
+        self.pmd.positions = self.P
+        self.pmd.velocities[:] = self.V
+        self.pmd.solve(1.0e-2, 10)
@@ -0,0 +1,195 @@
+"""
+Benchmarks of the snakelib hot paths.
+
+The classes follow the asv conventions: setup(*params) builds the state for each combination
+of params, then the time_* methods are timed. Run them with benchmarks/run.py.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        "book",
+        "machine_learning",
+        "exercises",
+        "tutorials",
+    ),
+)
+import snakelib as sl  # noqa: E402
+
+SEED = 0
+GRID_SIZES = [10, 20, 40]
+# Snake lengths, as shares of the longest snake of grown_snake.
+FILLS = [0.0, 0.5]
+
+
+def serpentine(N):
+    """
+    Returns the cells of a N x N grid visited by a path going down and up the columns 2 to
+    N - 2, starting next to the initial snake head.
+    """
+    cells = []
+    for j, col in enumerate(range(2, N - 1)):
+        rows = range(1, N - 1) if j % 2 == 0 else range(N - 2, 0, -1)
+        cells.extend(row * N + col for row in rows)
+    return cells
+
+
+def grown_snake(N, fill, seed=SEED):
+    """
+    Returns a N x N FastSnake whose snake was grown along `serpentine` up to a share fill of its
+    cells, each move eating a fruit placed on the next cell.
+    """
+    snake = sl.FastSnake(N, N, rng=seed)
+    path = serpentine(N)
+    steps = {1: 0, -N: 1, -1: 2, N: 3}
+    for pos in path[: int(fill * len(path))]:
+        snake.fruit_position = pos
+        snake.play(steps[pos - snake.head_position])
+    return snake
+
+
+class TimeFastSnake:
+    params = [GRID_SIZES]
+    param_names = ["grid"]
+
+    def setup(self, N):
+        self.snake = sl.FastSnake(N, N, rng=SEED)
+        rng = np.random.default_rng(SEED)
+        self.turns = rng.choice([-1, 0, 1], size=1000, p=[0.1, 0.8, 0.1]).tolist()
+
+    def time_turns(self, N):
+        # 1000 turns from the same seeded game, the lost games being reset.
+        snake = self.snake
+        snake.reset(rng=SEED)
+        for turn in self.turns:
+            snake.turn(turn)
+            if snake.status != 0:
+                snake.reset()
+
+    def time_play(self, N):
+        snake = self.snake
+        snake.reset(rng=SEED)
+        for turn in self.turns:
+            snake.play((snake.get_current_direction() + turn) % 4)
+            if snake.status != 0:
+                snake.reset()
+
+
+class TimeSensors:
+    params = [[10, 40], FILLS, ["default", "lidar", "elidar", "label"]]
+    param_names = ["grid", "fill", "method"]
+
+    def setup(self, N, fill, method):
+        self.snake = grown_snake(N, fill)
+
+    def time_sensors(self, N, fill, method):
+        self.snake.sensors(method)
+
+
+class TimeLabelSensors:
+    params = [GRID_SIZES, FILLS]
+    param_names = ["grid", "fill"]
+
+    def setup(self, N, fill):
+        self.snake = grown_snake(N, fill)
+
+    def time_get_label_sensors(self, N, fill):
+        self.snake.get_label_sensors()
+
+
+class TimeBatchSnake:
+    params = [[64, 1024], ["default", "label"]]
+    param_names = ["n_games", "method"]
+
+    def setup(self, n_games, method):
+        self.batch = sl.BatchSnake(
+            10, 10, n_games, rngs=[sl.game_seed(SEED, game) for game in range(n_games)]
+        )
+        self.turns = np.zeros(n_games, dtype=np.int64)
+
+    def time_sensors_step(self, n_games, method):
+        batch = self.batch
+        batch.sensors(method)
+        batch.step(self.turns)
+        finished = np.flatnonzero(batch.status != 0)
+        batch.reset_games(finished)
+
+
+class TimeNeuralAgent:
+    params = [["5-20-3", "7-64-64-3"]]
+    param_names = ["structure"]
+
+    def setup(self, structure):
+        structure = [int(n) for n in structure.split("-")]
+        functions = [sl.ReLu] * (len(structure) - 2) + [sl.identity]
+        rng = np.random.default_rng(SEED)
+        weights = rng.uniform(-1.0, 1.0, (1000, sl.count_weights(structure)))
+        self.caller = sl.NeuralAgent(weights[0], structure, functions).get_caller()
+        self.population = sl.NeuralPopulation(weights, structure, functions)
+        self.x = rng.choice([-1.0, 0.0, 1.0], size=(1000, structure[0]))
+
+    def time_inference(self, structure):
+        sl.arg_max(self.caller(self.x[0]))
+
+    def time_population_inference(self, structure):
+        # One decision of each of the 1000 agents.
+        self.population.get_turns(self.x)
+
+
+class TimeCompiledAgent:
+    def setup(self):
+        structure = [5, 20, 3]
+        rng = np.random.default_rng(SEED)
+        weights = rng.uniform(-1.0, 1.0, (1000, sl.count_weights(structure)))
+        self.population = sl.NeuralPopulation(
+            weights, structure, [sl.ReLu, sl.identity]
+        )
+        self.agent = sl.CompiledAgent(sl.compile_population(self.population)[0])
+        self.x = rng.choice([-1.0, 0.0, 1.0], size=5)
+
+    def time_compile_population(self):
+        sl.compile_population(self.population)
+
+    def time_get_turn(self):
+        self.agent.get_turn(self.x)
+
+
+class TimeGeneration:
+    params = [[False, True], [False, True]]
+    param_names = ["batched", "compiled"]
+    timeout = 300
+
+    def setup(self, batched, compiled):
+        self.trainer = sl.GeneticTrainer(
+            [5, 12, 3],
+            [sl.ReLu, sl.identity],
+            Npop=50,
+            Ntries=2,
+            max_turns=200,
+            n_workers=0,
+            batched=batched,
+            compiled=compiled,
+            seed=SEED,
+        )
+        trainer = self.trainer
+        self.initial = (trainer.weights.copy(), trainer.rng.bit_generator.state)
+
+    def teardown(self, batched, compiled):
+        self.trainer.close()
+
+    def time_generation(self, batched, compiled):
+        # The first generation, restored at each call.
+        trainer = self.trainer
+        weights, state = self.initial
+        trainer.weights[:] = weights
+        trainer.rng.bit_generator.state = state
+        trainer.generation = 0
+        trainer.history.clear()
+        trainer.step()
@@ -0,0 +1,126 @@
+"""
+Memory profile of the PMD derivative hot path.
+
+Compares the memory allocated per derivative call by the dense gravity model of
+book/ode/ressources/gravity.ipynb, the same model written on the PMD workspace and the PMD
+force registry with a GravityForce. Only the workspace model is allocation free: the registry
+path still allocates the total force of PMD.total_force and the all_pairs / pair_sum
+temporaries of the pair forces at each call. Run from the repository root:
+
+    python benchmarks/pmd_allocations.py
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "book", "ode", "ressources")
+)
+from PMD import PMD, GravityForce, central_forces, distances  # noqa: E402
+
+
+class Gravity(PMD):
+    """
+    The gravity.ipynb model.
+    """
+
+    def __init__(self, G=1.0, **kwargs):
+        self.G = G
+        super().__init__(**kwargs)
+
+    def derivative(self, X, t, cutoff_radius=1.0e-2):
+        m, G = self.m, self.G
+        n = len(m)
+        P = X[: 2 * n].reshape(n, 2)
+        V = X[2 * n :].reshape(n, 2)
+        M = m * m[:, np.newaxis]
+        D, R, U = distances(P)
+        np.fill_diagonal(R, np.inf)
+        if cutoff_radius > 0.0:
+            R = np.where(R > cutoff_radius, R, cutoff_radius)
+        F = ((G * M * R**-2)[:, :, np.newaxis] * U).sum(axis=0)
+        A = (F.T / m).T
+        X2 = X.copy()
+        X2[: 2 * n] = V.flatten()
+        X2[2 * n :] = A.flatten()
+        return X2
+
+
+class WorkspaceGravity(Gravity):
+    """
+    The same model on the PMD workspace and the cached M: no array is allocated, only the few
+    kB of the numpy iteration buffers of the broadcasting ufuncs and einsum.
+    """
+
+    def derivative(self, X, t, cutoff_radius=1.0e-2):
+        n = self._n
+        ws = self.workspace
+        P = X[: 2 * n].reshape(n, 2)
+        V = X[2 * n :].reshape(n, 2)
+        D, R, U = distances(P, out=(ws["D"], ws["R"], ws["U"]))
+        f = ws["f"]
+        np.maximum(R, cutoff_radius, out=f)
+        np.power(f, -2.0, out=f)
+        np.multiply(f, self.M, out=f)
+        f *= self.G
+        # The diagonal directions are null: no self force.
+        F = central_forces(f, U, out=ws["F"])
+        return self.state_derivative(V, F)
+
+
+def profile(model, X, ncalls):
+    """
+    Returns the traced memory allocated per call, the peak above the memory in use before the
+    call (median and max over the calls), and the time per call without tracing.
+    """
+    model.derivative(X, 0.0)
+    tracemalloc.start()
+    allocated = np.empty(ncalls)
+    for k in range(ncalls):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        model.derivative(X, 0.0)
+        allocated[k] = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    for _ in range(ncalls):
+        model.derivative(X, 0.0)
+    duration = time.perf_counter() - t0
+    return {
+        "bytes_per_call": float(np.median(allocated)),
+        "max_bytes_per_call": float(allocated.max()),
+        "us_per_call": 1.0e6 * duration / ncalls,
+    }
+
+
+def main(n=300, ncalls=200, seed=0):
+    rng = np.random.default_rng(seed)
+    P = rng.normal(size=(n, 2))
+    V = rng.normal(size=(n, 2))
+    m = rng.random(n)
+    reference = Gravity(m=m, P=P, V=V, nk=2)
+    model = WorkspaceGravity(m=m, P=P, V=V, nk=2)
+    registry = PMD(m=m, P=P, V=V, nk=2)
+    registry.add_force(GravityForce(G=1.0, cutoff_radius=1.0e-2))
+    X = reference.X[-1].copy()
+    error = np.abs(model.derivative(X, 0.0) - reference.derivative(X, 0.0)).max()
+    print(f"n = {n}, max derivative difference = {error:.3e}")
+    for name, s in (
+        ("notebook", reference),
+        ("workspace", model),
+        ("registry", registry),
+    ):
+        result = profile(s, X, ncalls)
+        print(
+            f"{name:>10}: {result['bytes_per_call'] / 1e3:.1f} kB/call "
+            f"(max {result['max_bytes_per_call'] / 1e3:.1f} kB), "
+            f"{result['us_per_call']:.0f} us/call"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Runs the asv style benchmarks of this directory (bench_*.py) and writes their timings to JSON.
+
+Each benchmark is timed for every combination of its params: the best time per call over
+several repeats, each repeat running enough calls to last min_time. The results of two commits
+can be compared with --compare. Run from the repository root:
+
+    python benchmarks/run.py -o results.json
+    python benchmarks/run.py -k Sensors -o new.json --compare results.json
+"""
+
+import argparse
+import datetime
+import importlib
+import inspect
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULES = ["bench_snakelib", "bench_pmd"]
+
+
+def get_params(cls):
+    """
+    Returns the parameter names and the combinations of params of a benchmark class.
+    """
+    params = getattr(cls, "params", [])
+    if params and not isinstance(params[0], (list, tuple)):
+        params = [params]
+    names = getattr(cls, "param_names", [f"param{i}" for i in range(len(params))])
+    return names, list(itertools.product(*params))
+
+
+def time_call(func, min_time=0.02, repeat=5):
+    """
+    Returns the best and median times per call of func over repeat runs of number calls, number
+    being the first power of 2 whose run lasts min_time.
+    """
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        duration = time.perf_counter() - t0
+        if duration >= min_time:
+            break
+        number *= 2
+    times = [duration / number]
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - t0) / number)
+    return {"best": min(times), "median": float(np.median(times)), "number": number}
+
+
+def run(pattern=None, min_time=0.02, repeat=5, verbose=True):
+    """
+    Runs the benchmarks whose name matches the regular expression pattern.
+
+    Returns
+    -------
+    list of dict
+        One entry per benchmark and params: name, params, best, median and number.
+    """
+    sys.path.insert(0, HERE)
+    results = []
+    for module_name in MODULES:
+        module = importlib.import_module(module_name)
+        for cls_name, cls in inspect.getmembers(module, inspect.isclass):
+            if not cls_name.startswith("Time") or cls.__module__ != module_name:
+                continue
+            methods = [m for m in dir(cls) if m.startswith("time_")]
+            names, combinations = get_params(cls)
+            for values in combinations:
+                selected = [
+                    m
+                    for m in methods
+                    if pattern is None
+                    or re.search(pattern, f"{module_name}.{cls_name}.{m}")
+                ]
+                if not selected:
+                    continue
+                bench = cls()
+                if hasattr(bench, "setup"):
+                    bench.setup(*values)
+                for method in selected:
+                    func = getattr(bench, method)
+                    timing = time_call(lambda: func(*values), min_time, repeat)
+                    entry = {
+                        "name": f"{module_name}.{cls_name}.{method}",
+                        "params": dict(zip(names, values)),
+                        **timing,
+                    }
+                    results.append(entry)
+                    if verbose:
+                        print(f"{format_entry(entry):<80} {format_time(entry['best'])}")
+                if hasattr(bench, "teardown"):
+                    bench.teardown(*values)
+    return results
+
+
+def format_entry(entry):
+    params = ", ".join(f"{k}={v}" for k, v in entry["params"].items())
+    return f"{entry['name']}({params})"
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1.0), ("ms", 1.0e-3), ("us", 1.0e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1.0e-9:8.2f} ns"
+
+
+def get_meta():
+    """
+    Returns the commit, date and environment of a run.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, reference, threshold=0.1):
+    """
+    Prints the ratio of the best times of results to the reference ones and returns the entries
+    slower by more than the threshold share.
+    """
+    key = lambda entry: (entry["name"], json.dumps(entry["params"], sort_keys=True))
+    base = {key(entry): entry for entry in reference["results"]}
+    regressions = []
+    for entry in results:
+        old = base.get(key(entry))
+        if old is None:
+            continue
+        ratio = entry["best"] / old["best"]
+        flag = ""
+        if ratio > 1.0 + threshold:
+            flag = "  slower"
+            regressions.append(entry)
+        elif ratio < 1.0 / (1.0 + threshold):
+            flag = "  faster"
+        print(f"{format_entry(entry):<80} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", help="the JSON results file")
+    parser.add_argument(
+        "-k", "--pattern", help="runs the benchmarks matching this regex"
+    )
+    parser.add_argument("--min-time", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare", help="a JSON results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+    results = run(args.pattern, args.min_time, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": get_meta(), "results": results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        print(f"\nCompared with {reference['meta']['commit']}:")
+        regressions = compare(results, reference, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
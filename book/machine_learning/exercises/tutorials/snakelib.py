@@ -1,3 +1,14 @@
+import hashlib
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import types
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from multiprocessing import shared_memory
+
 import numpy as np
 import ipywidgets as widgets
 import matplotlib.pyplot as plt
@@ -25,6 +36,22 @@ class FastSnake:
         The RGB color tuple for the fruit. Default is (0, 255, 0).
     void_color : tuple of int, optional
         The RGB color tuple for the empty space in the game grid. Default is (255, 255, 255).
+    record_turns : bool, optional
+        Whether to record each turn with the sensors and state it was taken from. Default is False.
+    recorded_sensors_method : str, optional
+        The sensors method used for recording. Default is "default".
+    recorder : EpisodeRecorder, optional
+        The recorder to use with record_turns, for example to gather many games in one dataset.
+        Default is None: the game records in its own recorder, cleared at each reset.
+    rng : numpy.random.Generator, SeedSequence or int, optional
+        The random stream used to place the fruits, see `game_seed`. Default is None: the global
+        numpy random state is used.
+    stall_check : int or str, optional
+        Ends the games that stall without eating with the status -4 (`STALLED`):
+        "cycle" when the state (snake body and fruit) repeats since the last fruit, which proves
+        that an agent deciding from the current state only loops forever; an int, or "grid" for
+        Ncell, when the snake made that many moves since the last fruit. Default is None (no
+        check).
 
     Attributes
     ----------
@@ -44,6 +71,10 @@ class FastSnake:
         A 3D array representing the game grid with RGB colors.
     authorized_positions : numpy.ndarray
         An array containing the positions of the authorized areas in the game grid.
+    forbidden : numpy.ndarray
+        A boolean (Ncell,) array flagging the forbidden positions.
+    occupancy : numpy.ndarray
+        A (Ncell,) array counting the snake segments on each cell, updated at each move.
     snake_color : tuple of int
         The RGB color tuple for the snake's body.
     snake_head_color : tuple of int
@@ -70,6 +101,9 @@ class FastSnake:
         record_turns=False,
         recorded_sensors_method="default",
         display_sensor_method=None,
+        recorder=None,
+        rng=None,
+        stall_check=None,
     ):
         self.Nrow = Nrow
         self.Ncol = Ncol
@@ -83,6 +117,8 @@ class FastSnake:
             )
         )
         self.forbidden_positions = forbidden_positions
+        self.forbidden = get_forbidden_mask(Nrow, Ncol)
+        self.neighbors = get_neighbors_table(Nrow, Ncol)
         self._grid = np.ones((Nrow, Ncol, 3), dtype=np.uint8) * 255
         self._lgrid = np.zeros((Nrow, Ncol), dtype=bool) * 1
         authorized_positions = np.setdiff1d(all_positions, forbidden_positions)
@@ -94,42 +130,108 @@ class FastSnake:
         self.void_color = void_color
         self.record_turns = record_turns
         self.recorded_sensors_method = recorded_sensors_method
+        if recorder is None and record_turns:
+            recorder = EpisodeRecorder(keep_episodes=False)
+        self.recorder = recorder
         self.display_sensor_method = display_sensor_method
         self.snake_max_length = snake_max_length
-        self.reset()
+        self.stall_check = stall_check
+        self._stall_limit = get_stall_limit(stall_check, Ncell)
+        self.rng = None
+        self.reset(rng=rng)
 
-    def reset(self, fix_seed=None):
+    def reset(self, fix_seed=None, rng=None):
         """
         Resets the game grid to its initial state by initializing snake and fruit positions, and resetting the score and status.
-        Optional parameter fix_seed (int) can be used to fix the random seed for the fruit position.
+        Optional parameter fix_seed (int) can be used to fix the random seed for the fruit position: it seeds the
+        global numpy random state, or a new stream if the game has its own.
+        Optional parameter rng (numpy Generator, SeedSequence or int) gives the game a new random stream.
         Returns
         -------
         None
         """
         # Get the attributes of the game grid
-        all_positions = self.all_positions
         Ncell = self.Ncell
         grid_values = self.grid_values
 
-        # Initialize the snake's positions and activation status
-        snake_positions = np.zeros_like(all_positions)
-        snake_active = np.zeros(Ncell, dtype=bool)
-        snake_active[:2] = True  # Set the first two positions as active
-        snake_positions[:2] = grid_values[1:3, 1]  # Set the initial snake position
-        self.snake_positions = snake_positions
-        self.snake_active = snake_active
+        # Initialize the snake ring buffer: the head is stored at _body[_head_index]
+        # and the following segments after it.
+        self._body = np.zeros(Ncell, dtype=np.int64)
+        self._body[:2] = grid_values[1:3, 1]  # Set the initial snake position
+        self._head_index = 0
+        self._length = 2
+
+        # Initialize the occupancy grid and the free positions list. The free positions
+        # are stored unordered in _free_cells[:_nfree], _free_slot giving the index of
+        # each free position in this list (-1 if not free).
+        self._free_cells = self.authorized_positions.astype(np.int64)
+        self._nfree = self._free_cells.size
+        self._free_slot = -np.ones(Ncell, dtype=np.int64)
+        self._free_slot[self._free_cells] = np.arange(self._nfree)
+        self.occupancy = np.zeros(Ncell, dtype=np.uint8)
+        for pos in self._body[:2]:
+            self._occupy(pos)
 
         # Set the initial fruit position and reset the score and status
+        if rng is not None:
+            self.rng = np.random.default_rng(rng)
         if fix_seed:
-            np.random.seed(fix_seed)
+            if self.rng is None:
+                np.random.seed(fix_seed)
+            else:
+                self.rng = np.random.default_rng(fix_seed)
 
         self.set_fruit()
         self.status = 0
         self.score = 0
-        self.recorded_turns = []
-        self.recorded_sensors = []
-        self.recorded_status = []
+        if self.recorder is not None:
+            self.recorder.new_episode()
         self.iteration = 0
+        self.moves_since_fruit = 0
+        self._seen_states = {self._state_key()} if self.stall_check == "cycle" else None
+
+    def _occupy(self, pos):
+        """
+        Adds a snake segment on a cell and removes it from the free positions if needed.
+        """
+        self.occupancy[pos] += 1
+        slot = self._free_slot[pos]
+        if slot >= 0:
+            # Swap the last free position into the released slot.
+            last = self._nfree - 1
+            moved = self._free_cells[last]
+            self._free_cells[slot] = moved
+            self._free_slot[moved] = slot
+            self._free_cells[last] = pos
+            self._free_slot[pos] = -1
+            self._nfree = last
+
+    def _release(self, pos):
+        """
+        Removes a snake segment from a cell and adds it to the free positions if needed.
+        """
+        self.occupancy[pos] -= 1
+        if self.occupancy[pos] == 0 and not self.forbidden[pos]:
+            self._free_cells[self._nfree] = pos
+            self._free_slot[pos] = self._nfree
+            self._nfree += 1
+
+    def get_snake_positions(self):
+        """
+        Returns the content of the snake ring buffer, head first. Only the first
+        `len(snake_active_positions)` values belong to the snake.
+        """
+        return np.roll(self._body, -self._head_index)
+
+    snake_positions = property(get_snake_positions)
+
+    def get_snake_active(self):
+        """
+        Returns the mask of the active values of `snake_positions`.
+        """
+        return np.arange(self.Ncell) < self._length
+
+    snake_active = property(get_snake_active)
 
     def get_snake_active_positions(self):
         """
@@ -140,11 +242,20 @@ class FastSnake:
         ndarray
             A 1D numpy array of the active snake positions.
         """
-        return self.snake_positions[self.snake_active]
+        ids = (self._head_index + np.arange(self._length)) % self.Ncell
+        return self._body[ids]
 
     # Define a property for the active snake positions
     snake_active_positions = property(get_snake_active_positions)
 
+    def get_head_position(self):
+        """
+        Returns the position of the snake head.
+        """
+        return self._body[self._head_index]
+
+    head_position = property(get_head_position)
+
     def get_free_positions(self):
         """
         Returns the positions on the game grid that are not forbidden or occupied by the active snake.
@@ -154,17 +265,28 @@ class FastSnake:
         ndarray
             A 1D numpy array of the free positions on the game grid.
         """
-        all_positions = self.all_positions
-        forbidden_positions = self.forbidden_positions
-        snake_positions = self.snake_active_positions
-        free_positions = np.setdiff1d(
-            all_positions, np.union1d(forbidden_positions, snake_positions)
-        )
-        return free_positions
+        return np.sort(self._free_cells[: self._nfree])
 
     # Define a property for the free positions on the game grid
     free_positions = property(get_free_positions)
 
+    def get_obstacles(self):
+        """
+        Returns a boolean (Ncell,) array flagging the forbidden positions and the snake cells.
+        """
+        return self.forbidden | (self.occupancy != 0)
+
+    obstacles = property(get_obstacles)
+
+    def is_obstacle(self, pos):
+        """
+        Returns True if the position is forbidden or occupied by the snake. Positions outside of
+        the grid are not obstacles.
+        """
+        return 0 <= pos < self.Ncell and (
+            self.forbidden[pos] or self.occupancy[pos] != 0
+        )
+
     def set_fruit(self):
         """
         Sets the position of a new fruit on the game grid, if there are any free positions available.
@@ -174,9 +296,13 @@ class FastSnake:
         -------
         None
         """
-        fp = self.free_positions
-        if len(fp) != 0:
-            self.fruit_position = np.random.choice(fp)
+        nfree = self._nfree
+        if nfree != 0:
+            if self.rng is None:
+                draw = np.random.randint(nfree)
+            else:
+                draw = self.rng.integers(nfree)
+            self.fruit_position = self._free_cells[draw]
         else:
             self.status = 1
 
@@ -198,7 +324,7 @@ class FastSnake:
         grid[:, :] = self.void_color
         # SNAKE
         snake_color = self.snake_color
-        spos = self.snake_positions[self.snake_active]
+        spos = self.snake_active_positions
         # srows = spos // Ncol
         # scols = spos % Ncol
         srows, scols = pos_to_coords(spos, Ncol)
@@ -265,16 +391,15 @@ class FastSnake:
         Returns:
             None
         """
-        # get forbidden positions and snake positions
-        forbidden_positions = self.forbidden_positions
-        snake_positions = self.snake_active_positions
+        # only the head can collide, the rest of the snake was checked at the previous moves
+        head = self._body[self._head_index]
 
         # check for self-collision
-        if np.unique(snake_positions).size != snake_positions.size:
+        if self.occupancy[head] > 1:
             self.status = -1
 
         # check for collision with forbidden positions
-        if np.intersect1d(forbidden_positions, snake_positions).size != 0:
+        if self.forbidden[head]:
             self.status = -2
 
     def play(self, direction):
@@ -294,6 +419,7 @@ class FastSnake:
                 -1 = snake collided with itself
                 -2 = snake collided with forbidden positions
                 -3 = invalid direction given
+                -4 = game stalled (see stall_check)
         """
 
         if self.status != 0:
@@ -301,43 +427,78 @@ class FastSnake:
             return self.status
         else:
             # Otherwise, update the game state based on the input direction.
-            snake_positions = self.snake_positions
+            Ncell = self.Ncell
+            body = self._body
+            head_index = self._head_index
+            length = self._length
             fruit_position = self.fruit_position
-            head = snake_positions[0]
-            neigh = get_neighbors(head, self.Nrow, self.Ncol)
-            new_head = neigh[int(direction)]
+            head = body[head_index]
+            new_head = self.neighbors[head, int(direction)]
 
             # Check if the new head would collide with the body of the snake.
-            if new_head == snake_positions[1]:
+            if new_head == body[(head_index + 1) % Ncell]:
                 self.status = -1
             # Check if the new head is out of bounds.
             elif new_head < 0:
                 self.status = -3
             else:
-                # Update the snake's position.
-                snake_positions[1:] = snake_positions[:-1]
-                snake_positions[0] = new_head
+                # Update the snake's position: the tail leaves its cell and the head
+                # is written in front of the ring buffer.
+                tail = body[(head_index + length - 1) % Ncell]
+                self._release(tail)
+                head_index = (head_index - 1) % Ncell
+                body[head_index] = new_head
+                self._head_index = head_index
+                self._occupy(new_head)
 
                 # If the snake eats a fruit, set a new fruit position and activate a new body segment.
                 if new_head == fruit_position:
                     snake_max_length = self.snake_max_length
                     self.set_fruit()
                     self.score += 1
-                    if (
-                        snake_max_length is None
-                        or len(self.snake_active_positions) < snake_max_length
+                    if length < Ncell and (
+                        snake_max_length is None or length < snake_max_length
                     ):
-                        sap = self.snake_active
-                        sap[:] = np.roll(sap, 1)
-                        sap[0] = True
+                        # The old tail is still stored right after the active segments.
+                        self._length = length + 1
+                        self._occupy(tail)
 
             # Check if the snake has collided with a forbidden position or with itself.
             self.iteration += 1
             self.check_defeat()
+            if self.status == 0 and self.stall_check is not None:
+                self._check_stall(new_head == fruit_position)
 
             # Return the updated game status.
             return self.status
 
+    def _state_key(self):
+        """
+        Returns the bytes of the snake positions, head first, which with the fruit position
+        define the game state.
+        """
+        ids = (self._head_index + np.arange(self._length)) % self.Ncell
+        return self._body[ids].tobytes()
+
+    def _check_stall(self, ate):
+        """
+        Counts the moves since the last fruit and ends the game if it stalled, see stall_check.
+        """
+        if ate:
+            self.moves_since_fruit = 0
+            if self._seen_states is not None:
+                self._seen_states = {self._state_key()}
+            return
+        self.moves_since_fruit += 1
+        if self._seen_states is not None:
+            key = self._state_key()
+            if key in self._seen_states:
+                self.status = STALLED
+            else:
+                self._seen_states.add(key)
+        elif self.moves_since_fruit >= self._stall_limit:
+            self.status = STALLED
+
     def turn(self, turn):
         """
         Turn the snake in a new direction.
@@ -358,13 +519,28 @@ class FastSnake:
             abs_direction = (current_direction + turn) % 4
             # Call the play method with the new direction
             if self.record_turns:
-                self.recorded_turns.append(turn)
-                self.recorded_sensors.append(
-                    self.sensors(method=self.recorded_sensors_method)
+                if self.recorder is None:
+                    self.recorder = EpisodeRecorder(keep_episodes=False)
+                self.recorder.append(
+                    turn,
+                    self.sensors(method=self.recorded_sensors_method),
+                    self.status,
+                    self.head_position,
+                    self.fruit_position,
+                    self._length,
                 )
-                self.recorded_status.append(self.status)
             self.play(abs_direction)
 
+    def _get_recorded(self, column):
+        if self.recorder is None:
+            return np.zeros(0)
+        return self.recorder.get_episode(column)
+
+    # Views on the recorded current game
+    recorded_turns = property(lambda self: self._get_recorded("turn"))
+    recorded_sensors = property(lambda self: self._get_recorded("sensors"))
+    recorded_status = property(lambda self: self._get_recorded("status"))
+
     def get_current_direction(self):
         """
         Returns the current direction of the snake based on the positions of its head and neck.
@@ -377,9 +553,9 @@ class FastSnake:
                 3 = down
                 -1 = if the direction could not be determined
         """
-        snake_positions = self.snake_active_positions
-        head_position = snake_positions[0]
-        neck_position = snake_positions[1]
+        head_index = self._head_index
+        head_position = self._body[head_index]
+        neck_position = self._body[(head_index + 1) % self.Ncell]
         Ncol = self.Ncol
         direction = -1
         if neck_position == head_position - 1:
@@ -406,8 +582,7 @@ class FastSnake:
             acos (float): The cosine of the angle between the fruit and the x-axis, in radians.
             asin (float): The sine of the angle between the fruit and the y-axis, in radians.
         """
-        snake_positions = self.snake_active_positions
-        snake_head_position = snake_positions[0]
+        snake_head_position = self.head_position
         fruit_position = self.fruit_position
         head_coords = np.array(pos_to_coords(snake_head_position, self.Ncol))
         fruit_coords = np.array(pos_to_coords(fruit_position, self.Ncol))
@@ -447,7 +622,7 @@ class FastSnake:
         """
 
         Ncol = self.Ncol
-        headpos = self.snake_active_positions[0]
+        headpos = self.head_position
         fdir = self.get_current_direction()
 
         # Calculate positions of the three neighboring positions
@@ -481,9 +656,6 @@ class FastSnake:
         Returns:
             out (ndarray): A numpy array of shape (3,) representing the state of the neighboring positions.
         """
-        forbidden_positions = self.forbidden_positions
-        snake_tail_positions = self.snake_active_positions[1:]
-        tail_and_lava = np.union1d(snake_tail_positions, forbidden_positions)
         fruit_position = self.fruit_position
 
         # Get the positions of the neighboring cells
@@ -495,165 +667,82 @@ class FastSnake:
             pos = positions[i]
             if pos == fruit_position:
                 out[i] = 1.0
-            elif pos in tail_and_lava:
+            elif self.is_obstacle(pos):
                 out[i] = -1
         return out
 
     def get_lidar(self):
         """
         Indicates the distance to the closest obstacle (lava or snake tail) in each direction (right, front and left) relatively to snake head.
+        The distance is Ncell if the fruit is met first.
         Returns:
             out (ndarray): A numpy array of shape (3,) representing the distance to the closest obstacle in each direction.
         """
-
-        def _compute_distance(all_sidepos):
-            for dist, sidepos in enumerate(all_sidepos):
-                if sidepos in tail_and_lava:
-                    return dist
-                elif sidepos == fruit_position:
-                    return self.Ncell
-
-        Ncol = self.Ncol
-        headpos = self.snake_active_positions[0]
-        forbidden_positions = self.forbidden_positions
-        snake_tail_positions = self.snake_active_positions[1:]
-        tail_and_lava = np.union1d(snake_tail_positions, forbidden_positions)
-        fruit_position = self.fruit_position
-        fdir = self.get_current_direction()
-
-        # Calculate positions of the three neighboring positions
-        if fdir == 0:
-            all_frontpos = np.arange(
-                headpos + 1, ((headpos // self.Ncol + 1) * self.Ncol)
-            )
-            all_leftpos = np.arange(headpos - Ncol, -1, -Ncol)
-            all_rightpos = np.arange(headpos + Ncol, self.Ncol**2, Ncol)
-        if fdir == 1:
-            all_frontpos = np.arange(headpos - Ncol, -1, -Ncol)
-            all_leftpos = np.arange(
-                headpos - 1, (headpos // self.Ncol) * self.Ncol - 1, -1
-            )
-            all_rightpos = np.arange(
-                headpos + 1, (headpos // self.Ncol + 1) * self.Ncol
-            )
-        if fdir == 2:
-            all_frontpos = np.arange(
-                headpos - 1, (headpos // self.Ncol) * self.Ncol - 1, -1
-            )
-            all_leftpos = np.arange(headpos + Ncol, self.Ncol**2, Ncol)
-            all_rightpos = np.arange(headpos - Ncol, -1, -Ncol)
-
-        if fdir == 3:
-            all_frontpos = np.arange(headpos + Ncol, self.Ncol**2, Ncol)
-            all_leftpos = np.arange(headpos + 1, (headpos // self.Ncol + 1) * self.Ncol)
-            all_rightpos = np.arange(
-                headpos - 1, (headpos // self.Ncol) * self.Ncol - 1, -1
-            )
-
-        out = np.zeros(3)
-
-        out[0] = _compute_distance(all_rightpos)
-        out[1] = _compute_distance(all_frontpos)
-        out[2] = _compute_distance(all_leftpos)
-
-        return out
+        return self._get_ray_distances(LIDAR_DIRECTIONS)
 
     def get_enhanched_lidar(self):
         """
         Indicates the distance to the closest obstacle (lava or snake tail) in each direction (right-back, right , front, left, left-back) relatively to snake head.
+        The distance is Ncell if the fruit is met first.
         Returns:
             out (ndarray): A numpy array of shape (5,) representing the distance to the closest obstacle in each direction.
         """
+        return self._get_ray_distances(ELIDAR_DIRECTIONS)
 
-        def _compute_distance(all_sidepos):
-            for dist, sidepos in enumerate(all_sidepos):
-                if sidepos in tail_and_lava:
-                    return dist
-                elif sidepos == fruit_position:
-                    return self.Ncell
-
-        out = np.zeros(5)
-
-        Ncol = self.Ncol
-        headpos = self.snake_active_positions[0]
-        forbidden_positions = self.forbidden_positions
-        snake_tail_positions = self.snake_active_positions[1:]
-        tail_and_lava = np.union1d(snake_tail_positions, forbidden_positions)
-        fruit_position = self.fruit_position
-        fdir = self.get_current_direction()
-
-        # Calculate positions of the three neighboring positions
-        out[1:4] = self.get_lidar()
-
-        # Calculate positions of the two back neighboring positions
-        if fdir == 0:
-            all_back_leftpos = np.arange(headpos - Ncol - 1, -1, -Ncol - 1)
-            all_back_rightpos = np.arange(headpos + Ncol - 1, self.Ncol**2, Ncol - 1)
-
-        if fdir == 1:
-            all_back_rightpos = np.arange(headpos + Ncol + 1, self.Ncol**2, Ncol + 1)
-            all_back_leftpos = np.arange(headpos + Ncol - 1, self.Ncol**2, Ncol - 1)
-
-        if fdir == 2:
-            all_back_rightpos = np.arange(headpos - Ncol + 1, -1, -Ncol + 1)
-            all_back_leftpos = np.arange(headpos + Ncol + 1, self.Ncol**2, Ncol + 1)
-
-        if fdir == 3:
-            all_back_rightpos = np.arange(headpos - Ncol - 1, -1, -Ncol - 1)
-            all_back_leftpos = np.arange(headpos - Ncol + 1, -1, -Ncol + 1)
-
-        out[0] = _compute_distance(all_back_rightpos)
-        out[4] = _compute_distance(all_back_leftpos)
-
-        return out
+    def _get_ray_distances(self, ray_directions):
+        """
+        Casts the rays of the given direction table (see LIDAR_DIRECTIONS) from the snake head,
+        using the ray table precomputed for the grid shape.
+        """
+        rays = get_ray_table(self.Nrow, self.Ncol)[
+            self.head_position, ray_directions[self.get_current_direction()]
+        ]
+        return ray_distances(
+            rays[np.newaxis],
+            self.obstacles[np.newaxis],
+            np.array([self.fruit_position]),
+        )[0]
 
     def get_label_sensors(self):
         """
         This function calculates the volume of free space in the direction of each possible turn for the snake.
 
-        The function first creates a grid representing the game area, with free positions marked as 1 and occupied positions as 0.
-        It then calculates the current direction of the snake and iterates over all possible turns (left, straight, right).
-        For each turn, it calculates the new head position if the snake were to take that turn.
-        If the new head position is not free, the volume for that turn is set to 0.
-        If the new head position is free, the function calculates the volume of the connected free space and stores it in the turn_volume array.
+        For each turn (right, straight, left), the new head position is computed. If it is not free, the
+        sensor is -1. Otherwise, the volume of the free region it belongs to is compared to the other turns:
+        the sensor is 1 for the turns leading to the largest free region and -1 for the others.
+
+        The free regions do not depend on the turn, so they are labeled at most once per call, and not at
+        all when the free neighbors are proven to be connected through the front diagonal cells (see
+        `turns_connected`).
 
         Returns:
-            turn_volume (numpy array): An array of size 3, where each element represents the volume of free space in the direction of a possible turn.
+            out (numpy array): An array of size 3, where each element is 1 if the turn leads to the largest free region, -1 otherwise.
         """
         Nrow = self.Nrow
         Ncol = self.Ncol
+        Ncell = self.Ncell
+
+        # Right, front, left, front-right and front-left cells of the head.
+        moore = (2 * self.get_current_direction() + np.array([-2, 0, 2, -1, 1])) % 8
+        head_row, head_col = pos_to_coords(self.head_position, Ncol)
+        rows = head_row + MOORE_ROWS[moore]
+        cols = head_col + MOORE_COLS[moore]
+        inside = (rows >= 0) & (rows < Nrow) & (cols >= 0) & (cols < Ncol)
+        pos = np.where(inside, rows * Ncol + cols, 0)
+        free = inside & ~self.forbidden[pos] & (self.occupancy[pos] == 0)
+        candidates = free[:3]
 
-        fpos = self.free_positions
-        frows, fcols = pos_to_coords(fpos, Ncol)
-        grid = self._lgrid
-        grid[:] = 0
-        grid[frows, fcols] = 1
-        headpos = pos_to_coords(self.snake_active_positions[0], Ncol)
-        currdir = self.get_current_direction()
-        turn_volume = np.zeros(3)
-        for tid, turn in enumerate(range(-1, 2)):
-            newdir = (currdir + turn) % 4
-            if newdir == 0:
-                new_headpos = (headpos[0], headpos[1] + 1)
-            elif newdir == 1:
-                new_headpos = (headpos[0] - 1, headpos[1])
-            elif newdir == 2:
-                new_headpos = (headpos[0], headpos[1] - 1)
-            elif newdir == 3:
-                new_headpos = (headpos[0] + 1, headpos[1])
-
-            if grid[new_headpos] == 0:
-                turn_volume[tid] = -1.0
-            else:
-                lgrid, nl = label(grid)
-                new_headlab = lgrid[new_headpos]
-                turn_volume[tid] = (lgrid == new_headlab).sum() / (lgrid != 0).sum()
         out = -np.ones(3)
-        for i in range(3):
-            if turn_volume[i] > 0.0:
-                if turn_volume[i] == turn_volume.max():
-                    out[i] = 1.0
+        if turns_connected(*free):
+            out[candidates] = 1.0
+            return out
 
+        grid = self._lgrid
+        grid[:] = ~self.obstacles.reshape(Nrow, Ncol)
+        lgrid, nl = label(grid)
+        lgrid = lgrid.ravel()
+        volume = np.where(candidates, np.bincount(lgrid)[lgrid[pos[:3]]], 0)
+        out[candidates & (volume == volume.max())] = 1.0
         return out
 
     def sensors(self, method="default"):
@@ -791,109 +880,1153 @@ def get_rank2_Moore_neighbors(pos, Ncol, Nrow):
     return out
 
 
-def show_gui(snake, ax, return_metrics=False):
-    # RELATIVE TURNS
+def game_seed(seed, *key):
+    """
+    Returns the SeedSequence of a game, addressed by a key such as (agent, trial).
 
-    left_widget = widgets.Button(
-        description="snake.turn(+1)",
-        disabled=False,
-        button_style="success",
-        tooltip="Want to go left ?",
-        icon="fa-arrow-left",
+    `game_seed(seed, i, j)` is the j-th child of the i-th child of `SeedSequence(seed)`, so that
+    the streams of any game can be rebuilt independently of the evaluation order.
+    """
+    return np.random.SeedSequence(seed, spawn_key=tuple(int(k) for k in key))
+
+
+@lru_cache(maxsize=None)
+def get_neighbors_table(Nrow, Ncol):
+    """
+    Returns the neighbors of every cell of a Nrow x Ncol grid, computed once per grid shape.
+
+    Returns
+    -------
+    ndarray
+        A read-only (Ncell, 4) integer array where row `pos` is `get_neighbors(pos, Nrow, Ncol)`:
+        right, up, left, down, -1 when the neighbor does not exist.
+    """
+    rows, cols = pos_to_coords(np.arange(Nrow * Ncol), Ncol)
+    pos = np.arange(Nrow * Ncol)
+    out = -np.ones((Nrow * Ncol, 4), dtype=np.int64)
+    out[:, 0] = np.where(cols < Ncol - 1, pos + 1, -1)
+    out[:, 1] = np.where(rows != 0, pos - Ncol, -1)
+    out[:, 2] = np.where(cols != 0, pos - 1, -1)
+    out[:, 3] = np.where(rows < Nrow - 1, pos + Ncol, -1)
+    out.setflags(write=False)
+    return out
+
+
+@lru_cache(maxsize=None)
+def get_forbidden_mask(Nrow, Ncol):
+    """
+    Returns a read-only boolean (Ncell,) array flagging the lava cells on the border of the grid.
+    """
+    mask = np.zeros((Nrow, Ncol), dtype=bool)
+    mask[0] = mask[-1] = mask[:, 0] = mask[:, -1] = True
+    mask = mask.ravel()
+    mask.setflags(write=False)
+    return mask
+
+
+# Status of the games ended by the stall check.
+STALLED = -4
+
+
+def get_stall_limit(stall_check, Ncell):
+    """
+    Returns the number of moves without fruit ending a game for a stall_check option (see
+    `FastSnake`), None if there is no such limit.
+    """
+    if stall_check is None or stall_check == "cycle":
+        return None
+    if stall_check == "grid":
+        return Ncell
+    if isinstance(stall_check, (int, np.integer)) and stall_check > 0:
+        return int(stall_check)
+    raise ValueError(f"Unknown stall check {stall_check!r}.")
+
+
+# Unit steps (row, col) of the absolute directions: right, up, left, down.
+DIRECTION_ROWS = np.array([0, -1, 0, 1])
+DIRECTION_COLS = np.array([1, 0, -1, 0])
+# Absolute directions of the relative turns right, forward, left for each direction.
+TURN_DIRECTIONS = (np.arange(4)[:, np.newaxis] + np.array([-1, 0, 1])) % 4
+# Unit steps of the 8 Moore directions: E, NE, N, NW, W, SW, S, SE.
+MOORE_ROWS = np.array([0, -1, -1, -1, 0, 1, 1, 1])
+MOORE_COLS = np.array([1, 1, 0, -1, -1, -1, 0, 1])
+# Moore directions of the lidar rays (right, front, left) for each direction.
+LIDAR_DIRECTIONS = 2 * TURN_DIRECTIONS
+# Moore directions of the enhanced lidar rays (back-right, right, front, left, back-left).
+ELIDAR_DIRECTIONS = (2 * np.arange(4)[:, np.newaxis] + np.array([5, -2, 0, 2, 3])) % 8
+
+
+@lru_cache(maxsize=None)
+def get_ray_table(Nrow, Ncol):
+    """
+    Returns the cells crossed by a ray cast from every cell in the 8 Moore directions,
+    computed once per grid shape.
+
+    Returns
+    -------
+    ndarray
+        A read-only (Ncell, 8, max(Nrow, Ncol)) integer array. Ray `[pos, d]` lists the cells met
+        when moving from `pos` in Moore direction `d` (the starting cell excluded), followed by
+        `Ncell` once the ray leaves the grid.
+    """
+    Ncell = Nrow * Ncol
+    L = max(Nrow, Ncol)
+    rows, cols = pos_to_coords(np.arange(Ncell), Ncol)
+    steps = np.arange(1, L + 1)
+    ray_rows = rows[:, None, None] + MOORE_ROWS[None, :, None] * steps
+    ray_cols = cols[:, None, None] + MOORE_COLS[None, :, None] * steps
+    inside = (ray_rows >= 0) & (ray_rows < Nrow) & (ray_cols >= 0) & (ray_cols < Ncol)
+    out = np.where(inside, ray_rows * Ncol + ray_cols, Ncell).astype(np.int32)
+    out.setflags(write=False)
+    return out
+
+
+def ray_distances(rays, obstacles, fruits):
+    """
+    Returns the lidar value of a batch of rays: the distance to the first obstacle, `Ncell` if
+    the fruit is seen first and nan if the ray leaves the grid.
+
+    Parameters
+    ----------
+    rays : ndarray
+        A (N, k, L) array of rays as given by `get_ray_table`.
+    obstacles : ndarray
+        A boolean (N, Ncell) array flagging the obstacles of each game.
+    fruits : ndarray
+        The (N,) fruit positions.
+
+    Returns
+    -------
+    ndarray
+        A (N, k) float array.
+    """
+    N, Ncell = obstacles.shape
+    cells = rays.reshape(N, -1)
+    outside = cells == Ncell
+    hit_obstacle = np.take_along_axis(obstacles, np.where(outside, 0, cells), axis=1)
+    hit_obstacle &= ~outside
+    hit = (hit_obstacle | outside | (cells == fruits[:, np.newaxis])).reshape(
+        rays.shape
+    )
+    first = np.argmax(hit, axis=-1)[..., np.newaxis]
+    dist = first[..., 0].astype(np.float64)
+    out = np.where(
+        np.take_along_axis(hit_obstacle.reshape(rays.shape), first, axis=-1)[..., 0],
+        dist,
+        float(Ncell),
     )
+    out[
+        np.take_along_axis(outside.reshape(rays.shape), first, axis=-1)[..., 0]
+    ] = np.nan
+    return out
 
-    right_widget = widgets.Button(
-        description="snake.turn(-1)",
-        disabled=False,
-        button_style="success",
-        tooltip="Want to go right ?",
-        icon="fa-arrow-right",
+
+def turns_connected(right, front, left, front_right, front_left):
+    """
+    Tells if the free cells among the right, front and left neighbors of the snake head are proven to
+    belong to the same free region, only looking at the front-right and front-left diagonal cells.
+    The back of the head being the snake neck, these are the only short paths between them.
+
+    Parameters
+    ----------
+    right, front, left, front_right, front_left : bool or ndarray of bool
+        True where the cell is free.
+
+    Returns
+    -------
+    bool or ndarray of bool
+        True if the free turns are connected, False if a labeling is needed to conclude.
+    """
+    right, front, left, front_right, front_left = (
+        np.asarray(free, dtype=bool)
+        for free in (right, front, left, front_right, front_left)
+    )
+    return (
+        (~(right & front) | front_right)
+        & (~(front & left) | front_left)
+        & (~(right & left) | (front & front_right & front_left))
     )
 
-    up_widget = widgets.Button(
-        description="snake.turn(0)",
-        disabled=False,
-        button_style="success",
-        tooltip="Want to go up ?",
-        icon="fa-arrow-up",
+
+def batch_sensors(heads, directions, occupancy, fruits, Nrow, Ncol, method="default"):
+    """
+    Returns the sensor readings of a batch of games at once, see `FastSnake.sensors`.
+
+    Parameters
+    ----------
+    heads : array_like
+        The (N,) head positions.
+    directions : array_like
+        The (N,) current directions of the snakes (0 = right, 1 = up, 2 = left, 3 = down).
+    occupancy : array_like
+        A (N, Ncell) array, non zero on the cells occupied by the snakes.
+    fruits : array_like
+        The (N,) fruit positions.
+    Nrow, Ncol : int
+        The grid shape.
+    method : str
+        "default", "lidar", "elidar" or "label".
+
+    Returns
+    -------
+    ndarray
+        A (N, 5) float array, (N, 7) with method "elidar".
+    """
+    heads = np.asarray(heads)
+    directions = np.asarray(directions)
+    fruits = np.asarray(fruits)
+    N = heads.size
+    Ncell = Nrow * Ncol
+    obstacles = (np.asarray(occupancy) != 0) | get_forbidden_mask(Nrow, Ncol)
+    head_rows, head_cols = pos_to_coords(heads, Ncol)
+
+    if method == "elidar":
+        out = np.zeros((N, 7), dtype=np.float64)
+    else:
+        out = np.zeros((N, 5), dtype=np.float64)
+
+    # Relative directions of the fruit: projections on the front and left unit vectors.
+    fruit_rows, fruit_cols = pos_to_coords(fruits, Ncol)
+    drow, dcol = fruit_rows - head_rows, fruit_cols - head_cols
+    left = (directions + 1) % 4
+    out[:, -2] = np.sign(
+        drow * DIRECTION_ROWS[directions] + dcol * DIRECTION_COLS[directions]
     )
+    out[:, -1] = np.sign(drow * DIRECTION_ROWS[left] + dcol * DIRECTION_COLS[left])
 
-    reset_widget = widgets.Button(
-        description="Reset",
-        disabled=False,
-        button_style="danger",
-        tooltip="Want to reset ?",
-        icon="fa-power-off",
+    # Cells next to the head in the right, front and left directions.
+    turn_dirs = TURN_DIRECTIONS[directions]
+    turn_pos = heads[:, np.newaxis] + (
+        DIRECTION_ROWS[turn_dirs] * Ncol + DIRECTION_COLS[turn_dirs]
     )
+    inside = (turn_pos >= 0) & (turn_pos < Ncell)
+    turn_pos = np.where(inside, turn_pos, 0)
 
-    # direction = 0
+    if method == "default":
+        blocked = inside & np.take_along_axis(obstacles, turn_pos, axis=1)
+        out[:, :3] = np.where(
+            turn_pos == fruits[:, np.newaxis], 1.0, np.where(blocked, -1.0, 0.0)
+        )
+    elif method in ("lidar", "elidar"):
+        rays = get_ray_table(Nrow, Ncol)
+        if method == "lidar":
+            ray_dirs = LIDAR_DIRECTIONS[directions]
+        else:
+            ray_dirs = ELIDAR_DIRECTIONS[directions]
+        k = ray_dirs.shape[1]
+        out[:, :k] = ray_distances(
+            rays[heads[:, np.newaxis], ray_dirs], obstacles, fruits
+        )
+    elif method == "label":
+        free = ~obstacles
+        candidates = inside & np.take_along_axis(free, turn_pos, axis=1)
+        diag_dirs = (2 * directions[:, np.newaxis] + np.array([-1, 1])) % 8
+        diag_rows = head_rows[:, np.newaxis] + MOORE_ROWS[diag_dirs]
+        diag_cols = head_cols[:, np.newaxis] + MOORE_COLS[diag_dirs]
+        diag_inside = (
+            (diag_rows >= 0)
+            & (diag_rows < Nrow)
+            & (diag_cols >= 0)
+            & (diag_cols < Ncol)
+        )
+        diag_pos = np.where(diag_inside, diag_rows * Ncol + diag_cols, 0)
+        diag_free = diag_inside & np.take_along_axis(free, diag_pos, axis=1)
+        best = candidates.copy()
+
+        # Only the games whose free turns are not locally connected need a labeling.
+        need = ~turns_connected(*candidates.T, *diag_free.T)
+        if need.any():
+            structure = np.zeros((3, 3, 3), dtype=bool)
+            structure[1] = [[0, 1, 0], [1, 1, 1], [0, 1, 0]]
+            labels, _ = label(free[need].reshape(-1, Nrow, Ncol), structure=structure)
+            labels = labels.reshape(-1, Ncell)
+            sizes = np.bincount(labels.ravel())
+            volume = np.where(
+                candidates[need],
+                sizes[np.take_along_axis(labels, turn_pos[need], axis=1)],
+                0,
+            )
+            best[need] &= volume == volume.max(axis=1)[:, np.newaxis]
+        out[:, :3] = np.where(best, 1.0, -1.0)
+    return out
 
-    def select_sensors_method(method):
-        snake.recorded_sensors_method = method
-        print(f"Selected method {method}")
 
-    def set_turn(turn):
-        snake.turn(turn)
-        # print(snake.sensors(method="label"))
-        update_fig()
+class BatchSnake:
+    """
+    A batch of independent Snake games stored in stacked numpy arrays and advanced together.
 
-    def reset_game():
-        snake.reset()
-        update_fig()
+    Every game follows exactly the rules of `FastSnake.play`, but all games are updated at once
+    by array operations: finished games are simply masked out.
 
-    left_widget.on_click(lambda arg: set_turn(1.0))
-    right_widget.on_click(lambda arg: set_turn(-1.0))
-    up_widget.on_click(lambda arg: set_turn(0.0))
-    reset_widget.on_click(lambda arg: reset_game())
+    Parameters
+    ----------
+    Nrow : int
+        The number of rows in the game grid.
+    Ncol : int
+        The number of columns in the game grid.
+    n_games : int
+        The number of games in the batch.
+    snake_max_length : int, optional
+        The maximum length of the snakes. Default is None (no limit).
+    rngs : sequence, optional
+        One random stream per game (numpy Generator, SeedSequence or seed, see `game_seed`).
+        Default is None: the fruits are drawn from the global numpy random state.
+    stall_check : int or str, optional
+        Ends the stalled games with the status -4, see `FastSnake`. Default is None.
 
-    def update_fig():
-        im.set_array(snake.grid)
-        status = snake.status
-        if status == 0:
-            mess = "PLAY"
-        elif status == -1:
-            mess = "YOU DIED (YOURSELF)"
-        elif status == -2:
-            mess = "YOU DIED (LAVA)"
-        sensor_method = snake.display_sensor_method
-        if sensor_method == None:
-            sensors = ""
-        else:
-            sensors = str(snake.sensors(method=sensor_method))
-        title.set_text(f"Score = {snake.score}, {mess} {sensors}")
-        plt.draw()
-        return (im,)
+    Attributes
+    ----------
+    body : numpy.ndarray
+        A (n_games, Ncell) ring buffer holding the snake positions, the head of game `i` being
+        stored at `body[i, head_index[i]]` and the following segments after it.
+    head_index : numpy.ndarray
+        The index of the head of each snake in the ring buffer.
+    length : numpy.ndarray
+        The length of each snake.
+    occupancy : numpy.ndarray
+        A (n_games, Ncell) array counting the snake segments on each cell.
+    free_cells : numpy.ndarray
+        A (n_games, Ncell) array listing, unordered, the nfree free positions of each game.
+    nfree : numpy.ndarray
+        The number of free positions of each game.
+    fruit_position : numpy.ndarray
+        The fruit position of each game.
+    status : numpy.ndarray
+        The status of each game, with the same codes as `FastSnake.play`.
+    score : numpy.ndarray
+        The score of each game.
+    iteration : numpy.ndarray
+        The number of moves played in each game.
+    """
 
-    ax.axis("off")
-    title = ax.set_title(f"Score = {snake.score}, PLAY ")
-    im = ax.imshow(snake.grid, interpolation="nearest", animated=True)
-    update_fig()
-    box = widgets.Box([left_widget, right_widget, up_widget, reset_widget])
-    # Add a standalone legend  gray box = head, black box = body, red box = wall, green box = fruit
-    entries = {"Head": "gray", "Body": "black", "Wall": "red", "Fruit": "green"}
+    def __init__(
+        self, Nrow, Ncol, n_games, snake_max_length=None, rngs=None, stall_check=None
+    ):
+        self.Nrow = Nrow
+        self.Ncol = Ncol
+        self.Ncell = Nrow * Ncol
+        self.n_games = n_games
+        self.snake_max_length = snake_max_length
+        self.stall_check = stall_check
+        self._stall_limit = get_stall_limit(stall_check, self.Ncell)
+        self.neighbors = get_neighbors_table(Nrow, Ncol)
+        self.forbidden = get_forbidden_mask(Nrow, Ncol)
+        self.rngs = None
+        self.reset(rngs=rngs)
+
+    def reset(self, fix_seed=None, rngs=None):
+        """
+        Resets all the games to their initial state, see `FastSnake.reset`.
+
+        Parameters
+        ----------
+        fix_seed : int, optional
+            Seeds the global numpy random state, or the stream of every game if they have one.
+        rngs : sequence, optional
+            New random streams, one per game.
+        """
+        n_games, Ncell, Ncol = self.n_games, self.Ncell, self.Ncol
+        self.body = np.zeros((n_games, Ncell), dtype=np.int64)
+        self.body[:, 0] = Ncol + 1
+        self.body[:, 1] = 2 * Ncol + 1
+        self.head_index = np.zeros(n_games, dtype=np.int64)
+        self.length = np.full(n_games, 2, dtype=np.int64)
+        self.occupancy = np.zeros((n_games, Ncell), dtype=np.uint8)
+        authorized = np.flatnonzero(~self.forbidden)
+        self.free_cells = np.zeros((n_games, Ncell), dtype=np.int64)
+        self.free_cells[:, : authorized.size] = authorized
+        self.free_slot = -np.ones((n_games, Ncell), dtype=np.int64)
+        self.free_slot[:, authorized] = np.arange(authorized.size)
+        self.nfree = np.full(n_games, authorized.size, dtype=np.int64)
+        games = np.arange(n_games)
+        self._occupy(games, self.body[:, 0])
+        self._occupy(games, self.body[:, 1])
+        self.fruit_position = np.zeros(n_games, dtype=np.int64)
+        self.status = np.zeros(n_games, dtype=np.int64)
+        self.score = np.zeros(n_games, dtype=np.int64)
+        self.iteration = np.zeros(n_games, dtype=np.int64)
+        self.moves_since_fruit = np.zeros(n_games, dtype=np.int64)
+        self._seen_states = None
+        if self.stall_check == "cycle":
+            self._seen_states = [{self._state_key(game)} for game in games]
+
+        if rngs is not None:
+            if len(rngs) != n_games:
+                raise ValueError(f"Expected {n_games} random streams, got {len(rngs)}.")
+            self.rngs = [np.random.default_rng(rng) for rng in rngs]
+        if fix_seed:
+            if self.rngs is None:
+                np.random.seed(fix_seed)
+            else:
+                self.rngs = [
+                    np.random.default_rng(game_seed(fix_seed, game)) for game in games
+                ]
 
-    f = lambda m, c: ax.plot([], [], marker=m, color=c, ls="none")[0]
-    handles = [f("s", val) for key, val in entries.items()]
-    labels = [key for key, val in entries.items()]
-    ax.legend(handles, labels, loc=(1.1, 0), framealpha=1, frameon=False)
+        self.set_fruit(games)
 
-    return box
+    def reset_games(self, games, rngs=None):
+        """
+        Resets some games to their initial state, the other ones being left as they are.
+
+        Parameters
+        ----------
+        games : array_like
+            The indices of the games to reset, without repetition.
+        rngs : sequence, optional
+            New random streams, one per reset game. The batch must have per-game streams.
+        """
+        games = np.asarray(games, dtype=np.int64)
+        if games.size == 0:
+            return
+        Ncol = self.Ncol
+        authorized = np.flatnonzero(~self.forbidden)
+        self.body[games] = 0
+        self.body[games, 0] = Ncol + 1
+        self.body[games, 1] = 2 * Ncol + 1
+        self.head_index[games] = 0
+        self.length[games] = 2
+        self.occupancy[games] = 0
+        self.free_cells[games] = 0
+        self.free_cells[games, : authorized.size] = authorized
+        self.free_slot[games] = -1
+        self.free_slot[games[:, np.newaxis], authorized] = np.arange(authorized.size)
+        self.nfree[games] = authorized.size
+        self._occupy(games, self.body[games, 0])
+        self._occupy(games, self.body[games, 1])
+        self.status[games] = 0
+        self.score[games] = 0
+        self.iteration[games] = 0
+        self.moves_since_fruit[games] = 0
+        if self._seen_states is not None:
+            for game in games:
+                self._seen_states[game] = {self._state_key(game)}
+        if rngs is not None:
+            if self.rngs is None:
+                raise ValueError("The batch has no per-game random streams.")
+            for game, rng in zip(games, rngs):
+                self.rngs[game] = np.random.default_rng(rng)
+        self.set_fruit(games)
+
+    def _occupy(self, games, pos):
+        """
+        Adds a snake segment on a cell of each given game, see `FastSnake._occupy`.
+        """
+        self.occupancy[games, pos] += 1
+        slot = self.free_slot[games, pos]
+        taken = slot >= 0
+        games, pos, slot = games[taken], pos[taken], slot[taken]
+        last = self.nfree[games] - 1
+        moved = self.free_cells[games, last]
+        self.free_cells[games, slot] = moved
+        self.free_slot[games, moved] = slot
+        self.free_cells[games, last] = pos
+        self.free_slot[games, pos] = -1
+        self.nfree[games] = last
+
+    def _release(self, games, pos):
+        """
+        Removes a snake segment from a cell of each given game, see `FastSnake._release`.
+        """
+        self.occupancy[games, pos] -= 1
+        freed = (self.occupancy[games, pos] == 0) & ~self.forbidden[pos]
+        games, pos = games[freed], pos[freed]
+        nfree = self.nfree[games]
+        self.free_cells[games, nfree] = pos
+        self.free_slot[games, pos] = nfree
+        self.nfree[games] = nfree + 1
+
+    def get_heads(self):
+        """
+        Returns the head position of each snake.
+        """
+        return self.body[np.arange(self.n_games), self.head_index]
 
-    def show_record(self):
+    heads = property(get_heads)
+
+    def get_snake_active_positions(self, game):
         """
-        Show the recorded sensors and turns
+        Returns the positions of the snake of a given game, head first.
         """
-        pass
+        ids = (self.head_index[game] + np.arange(self.length[game])) % self.Ncell
+        return self.body[game, ids]
 
+    def set_fruit(self, games):
+        """
+        Sets a new fruit uniformly on the free cells of the given games. Games without any free
+        cell are won (status 1).
 
-class NeuralAgent:
-    """
-    A NEURAL NETWORK AGENT
-    """
+        With per-game random streams, each game draws from its own stream exactly as a FastSnake
+        would, so that a game does not depend on the rest of the batch. Only the games setting a
+        fruit are visited.
+        """
+        games = np.asarray(games)
+        if games.size == 0:
+            return
+        nfree = self.nfree[games]
+        won = nfree == 0
+        self.status[games[won]] = 1
+        games, nfree = games[~won], nfree[~won]
+        if self.rngs is None:
+            draw = np.random.randint(0, nfree)
+        else:
+            rngs = self.rngs
+            draw = np.array(
+                [rngs[game].integers(n) for game, n in zip(games, nfree)],
+                dtype=np.int64,
+            )
+        self.fruit_position[games] = self.free_cells[games, draw]
 
-    def __init__(self, weights, structure, neural_functions):
-        matrices = []
-        start = 0
+    def get_current_direction(self):
+        """
+        Returns the current direction of each snake (same codes as `FastSnake.get_current_direction`).
+        """
+        games = np.arange(self.n_games)
+        head = self.body[games, self.head_index]
+        neck = self.body[games, (self.head_index + 1) % self.Ncell]
+        delta = head - neck
+        direction = -np.ones(self.n_games, dtype=np.int64)
+        direction[delta == 1] = 0
+        direction[delta == -self.Ncol] = 1
+        direction[delta == -1] = 2
+        direction[delta == self.Ncol] = 3
+        return direction
+
+    def sensors(self, method="default"):
+        """
+        Returns the sensor readings of all the games, see `batch_sensors`.
+
+        Returns
+        -------
+        ndarray
+            A (n_games, 5) float array, (n_games, 7) with method "elidar".
+        """
+        return batch_sensors(
+            self.heads,
+            self.get_current_direction(),
+            self.occupancy,
+            self.fruit_position,
+            self.Nrow,
+            self.Ncol,
+            method=method,
+        )
+
+    def play(self, directions):
+        """
+        Moves every running snake in the given absolute direction, see `FastSnake.play`.
+
+        Parameters
+        ----------
+        directions : array_like
+            The (n_games,) absolute directions, ignored for finished games.
+
+        Returns
+        -------
+        ndarray
+            The status of each game.
+        """
+        Ncell = self.Ncell
+        status = self.status
+        directions = np.asarray(directions).astype(np.int64)
+        games = np.flatnonzero(status == 0)
+        if games.size == 0:
+            return status
+        self.iteration[games] += 1
+        h = self.head_index[games]
+        length = self.length[games]
+        neck = self.body[games, (h + 1) % Ncell]
+        new_head = self.neighbors[self.body[games, h], directions[games]]
+
+        # Reversal and out of bounds moves end the game without moving the snake.
+        reverse = new_head == neck
+        outside = ~reverse & (new_head < 0)
+        status[games[reverse]] = -1
+        status[games[outside]] = -3
+        move = ~(reverse | outside)
+        games, h, length, new_head = games[move], h[move], length[move], new_head[move]
+
+        # The tail leaves its cell and the head moves in front of the ring buffer.
+        tail = self.body[games, (h + length - 1) % Ncell]
+        self._release(games, tail)
+        h = (h - 1) % Ncell
+        self.body[games, h] = new_head
+        self.head_index[games] = h
+        self._occupy(games, new_head)
+
+        # Eating: the new fruit is set before the snake grows back on its old tail.
+        eat = new_head == self.fruit_position[games]
+        self.set_fruit(games[eat])
+        self.score[games[eat]] += 1
+        grow = eat & (length < Ncell)
+        if self.snake_max_length is not None:
+            grow &= length < self.snake_max_length
+        self._occupy(games[grow], tail[grow])
+        self.length[games[grow]] += 1
+
+        # Defeat conditions, lava prevails over self collision.
+        status[games[self.occupancy[games, new_head] > 1]] = -1
+        status[games[self.forbidden[new_head]]] = -2
+        if self.stall_check is not None:
+            self._check_stall(games, eat)
+        return status
+
+    def _state_key(self, game):
+        """
+        Returns the state bytes of a game, see `FastSnake._state_key`.
+        """
+        return self.get_snake_active_positions(game).tobytes()
+
+    def _check_stall(self, games, eat):
+        """
+        Ends the stalled games among the games that moved, see `FastSnake._check_stall`.
+        """
+        status = self.status
+        seen = self._seen_states
+        self.moves_since_fruit[games[eat]] = 0
+        if seen is not None:
+            for game in games[eat]:
+                seen[game] = {self._state_key(game)}
+        games = games[~eat]
+        self.moves_since_fruit[games] += 1
+        games = games[status[games] == 0]
+        if seen is None:
+            status[games[self.moves_since_fruit[games] >= self._stall_limit]] = STALLED
+            return
+        for game in games:
+            key = self._state_key(game)
+            if key in seen[game]:
+                status[game] = STALLED
+            else:
+                seen[game].add(key)
+
+    def turn(self, turns):
+        """
+        Turns every running snake, see `FastSnake.turn`.
+
+        Parameters
+        ----------
+        turns : array_like
+            The (n_games,) relative turns: 0 = forward, 1 = left, -1 = right.
+
+        Returns
+        -------
+        ndarray
+            The status of each game.
+        """
+        directions = (self.get_current_direction() + np.asarray(turns)) % 4
+        return self.play(directions)
+
+    def step(self, turns):
+        """
+        Advances all the running games by one turn.
+
+        Parameters
+        ----------
+        turns : array_like
+            The (n_games,) relative turns: 0 = forward, 1 = left, -1 = right.
+
+        Returns
+        -------
+        status : ndarray
+            The status of each game.
+        score : ndarray
+            The score of each game.
+        """
+        self.turn(turns)
+        return self.status, self.score
+
+
+class EpisodeRecorder:
+    """
+    A columnar recorder of Snake game steps.
+
+    Each step is stored in preallocated typed numpy buffers, grown by doubling, with the columns:
+    episode, turn, status, head, fruit, length (the state the turn was taken from) and sensors.
+    When a path is given, full chunks are flushed to disk so that the memory use stays bounded.
+
+    Parameters
+    ----------
+    capacity : int, optional
+        The initial number of steps of the buffers. Default is 1024.
+    path : str, optional
+        The directory where the chunks are flushed. Default is None (keep everything in memory).
+    chunk_size : int, optional
+        The number of steps per flushed chunk, only with a path. Default is 2**20 when path is
+        given.
+    file_format : str, optional
+        "npz" (one compact file per chunk) or "npy" (one file per column and chunk, which can be
+        memory-mapped, see `load_recording`). Default is "npy".
+    sensors_dtype : numpy dtype, optional
+        The sensors storage type. Default is float32, exact for all the sensor methods.
+    keep_episodes : bool, optional
+        Whether `new_episode` keeps the previous episodes. Default is True, False clears them.
+    """
+
+    columns = {
+        "episode": np.int32,
+        "turn": np.int8,
+        "status": np.int8,
+        "head": np.int32,
+        "fruit": np.int32,
+        "length": np.int32,
+    }
+
+    def __init__(
+        self,
+        capacity=1024,
+        path=None,
+        chunk_size=None,
+        file_format="npy",
+        sensors_dtype=np.float32,
+        keep_episodes=True,
+    ):
+        if file_format not in ("npy", "npz"):
+            raise ValueError(f"Unknown file format {file_format!r}.")
+        if path is None and chunk_size is not None:
+            raise ValueError("chunk_size requires a path to flush the chunks to.")
+        if path is not None:
+            if chunk_size is None:
+                chunk_size = 2**20
+            os.makedirs(path, exist_ok=True)
+            capacity = chunk_size
+        self.path = path
+        self.chunk_size = chunk_size
+        self.file_format = file_format
+        self.sensors_dtype = sensors_dtype
+        self.keep_episodes = keep_episodes
+        self.capacity = capacity
+        self.data = {
+            name: np.zeros(capacity, dtype=dtype)
+            for name, dtype in self.columns.items()
+        }
+        self.data["sensors"] = None
+        self.size = 0
+        self.episode = -1
+        self.episode_start = 0
+        self._episode_opened = False
+        self.chunks = 0
+
+    def __len__(self):
+        return self.size
+
+    def new_episode(self):
+        """
+        Starts a new episode, clearing the buffers if keep_episodes is False. Its number is
+        taken by its first step, so that the episodes without steps are not counted.
+        """
+        if not self.keep_episodes:
+            self.size = 0
+            self.data["sensors"] = None
+        self.episode_start = self.size
+        self._episode_opened = False
+
+    def _grow(self, capacity):
+        for name, column in self.data.items():
+            if column is not None:
+                new_column = np.zeros(
+                    (capacity,) + column.shape[1:], dtype=column.dtype
+                )
+                new_column[: self.size] = column[: self.size]
+                self.data[name] = new_column
+        self.capacity = capacity
+
+    def append(self, turn, sensors, status, head, fruit, length):
+        """
+        Records one step.
+        """
+        data = self.data
+        if data["sensors"] is None:
+            data["sensors"] = np.zeros(
+                (self.capacity, len(sensors)), dtype=self.sensors_dtype
+            )
+        elif len(sensors) != data["sensors"].shape[1]:
+            raise ValueError(
+                f"Expected {data['sensors'].shape[1]} sensors, got {len(sensors)}."
+            )
+        if self.size == self.capacity:
+            self._grow(2 * self.capacity)
+        if not self._episode_opened:
+            self.episode += 1
+            self._episode_opened = True
+        i = self.size
+        data["episode"][i] = self.episode
+        data["turn"][i] = turn
+        data["status"][i] = status
+        data["head"][i] = head
+        data["fruit"][i] = fruit
+        data["length"][i] = length
+        data["sensors"][i] = sensors
+        self.size = i + 1
+        if self.chunk_size is not None and self.size == self.chunk_size:
+            self.flush()
+
+    def get(self, column):
+        """
+        Returns a view on the recorded values of a column still in memory.
+        """
+        values = self.data[column]
+        if values is None:
+            return np.zeros((0, 0), dtype=self.sensors_dtype)
+        return values[: self.size]
+
+    def get_episode(self, column):
+        """
+        Returns a view on the in memory values of a column for the current episode.
+        """
+        return self.get(column)[self.episode_start :]
+
+    def flush(self):
+        """
+        Writes the steps in memory as a new chunk in path and empties the buffers.
+        """
+        if self.path is None:
+            raise ValueError("The recorder has no path to flush to.")
+        if self.size == 0:
+            return
+        columns = {name: self.get(name) for name in self.data}
+        if self.file_format == "npz":
+            np.savez(os.path.join(self.path, f"chunk_{self.chunks:06d}.npz"), **columns)
+        else:
+            for name, values in columns.items():
+                np.save(
+                    os.path.join(self.path, f"{name}_{self.chunks:06d}.npy"), values
+                )
+        self.chunks += 1
+        self.size = 0
+        self.episode_start = 0
+
+    def to_frame(self):
+        """
+        Returns the steps in memory as a pandas DataFrame whose columns are views on the buffers,
+        the sensors being split in columns s0, s1, ...
+        """
+        import pandas as pd
+
+        out = {name: self.get(name) for name in self.columns}
+        for i, values in enumerate(self.get("sensors").T):
+            out[f"s{i}"] = values
+        return pd.DataFrame(out, copy=False)
+
+
+def load_recording(path, mmap_mode=None):
+    """
+    Loads the chunks flushed by an EpisodeRecorder in a directory.
+
+    Parameters
+    ----------
+    path : str
+        The recorder directory.
+    mmap_mode : str, optional
+        Memory-maps the "npy" chunks (see `numpy.load`), for example "r".
+
+    Returns
+    -------
+    dict
+        Each column as an array, or as the list of its chunks with mmap_mode.
+    """
+    names = sorted(os.listdir(path))
+    out = {}
+    for name in names:
+        if name.endswith(".npz"):
+            with np.load(os.path.join(path, name)) as chunk:
+                for column in chunk.files:
+                    out.setdefault(column, []).append(chunk[column])
+        elif name.endswith(".npy"):
+            column = name.rsplit("_", 1)[0]
+            out.setdefault(column, []).append(
+                np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+            )
+    if mmap_mode is None:
+        out = {column: np.concatenate(chunks) for column, chunks in out.items()}
+    return out
+
+
+class FrameRenderer:
+    """
+    A headless renderer of recorded Snake episodes.
+
+    The frames use the `FastSnake.grid` colors. Each frame is built from the previous one by
+    painting only the cells that changed (new head, old head, released tail and fruits), each
+    cell being a scale x scale block of pixels.
+
+    Parameters
+    ----------
+    Nrow : int
+        The number of rows in the game grid.
+    Ncol : int
+        The number of columns in the game grid.
+    scale : int, optional
+        The size of a cell in pixels. Default is 1.
+    snake_color, snake_head_color, forbidden_color, fruit_color, void_color : tuple of int, optional
+        The RGB colors, with the same defaults as FastSnake.
+    """
+
+    def __init__(
+        self,
+        Nrow,
+        Ncol,
+        scale=1,
+        snake_color=(0, 0, 0),
+        snake_head_color=(128, 128, 128),
+        forbidden_color=(255, 0, 0),
+        fruit_color=(0, 255, 0),
+        void_color=(255, 255, 255),
+    ):
+        self.Nrow = Nrow
+        self.Ncol = Ncol
+        self.scale = scale
+        self.forbidden = get_forbidden_mask(Nrow, Ncol)
+        self.snake_color = np.array(snake_color, dtype=np.uint8)
+        self.snake_head_color = np.array(snake_head_color, dtype=np.uint8)
+        self.forbidden_color = np.array(forbidden_color, dtype=np.uint8)
+        self.fruit_color = np.array(fruit_color, dtype=np.uint8)
+        self.void_color = np.array(void_color, dtype=np.uint8)
+        self.shape = (Nrow * scale, Ncol * scale, 3)
+
+    def _cell_color(self, pos, head, fruit, count):
+        # Same priorities as FastSnake.get_grid
+        if pos == fruit:
+            return self.fruit_color
+        if self.forbidden[pos]:
+            return self.forbidden_color
+        if pos == head:
+            return self.snake_head_color
+        if count[pos]:
+            return self.snake_color
+        return self.void_color
+
+    def _paint(self, frame, pos, color):
+        s = self.scale
+        row, col = divmod(int(pos), self.Ncol)
+        frame[row * s : (row + 1) * s, col * s : (col + 1) * s] = color
+
+    def render(self, heads, fruits, lengths, out=None):
+        """
+        Renders a whole episode, from the reset of the game.
+
+        Parameters
+        ----------
+        heads, fruits, lengths : numpy.ndarray
+            The (T,) head positions, fruit positions and snake lengths of the episode steps, as
+            recorded by an EpisodeRecorder.
+        out : numpy.ndarray or str, optional
+            The (T, H, W, 3) uint8 output array, or the path of a ".npy" file written as a
+            memory-map. Default is None: a new array is allocated.
+
+        Returns
+        -------
+        numpy.ndarray
+            The (T, H, W, 3) uint8 frames, frame t showing the state turn t was taken from.
+        """
+        heads = np.asarray(heads)
+        fruits = np.asarray(fruits)
+        lengths = np.asarray(lengths)
+        T = len(heads)
+        shape = (T,) + self.shape
+        if out is None:
+            out = np.empty(shape, dtype=np.uint8)
+        elif isinstance(out, str):
+            out = np.lib.format.open_memmap(out, mode="w+", dtype=np.uint8, shape=shape)
+        if T == 0:
+            return out
+        Ncol = self.Ncol
+
+        # The snake is the last lengths[t] cells of the path, which starts with the neck at reset.
+        path = np.concatenate([[2 * Ncol + 1], heads])
+        tails = np.arange(T) + 2 - lengths
+        count = np.zeros(self.Nrow * Ncol, dtype=np.int64)
+        np.add.at(count, path[tails[0] : 2], 1)
+
+        # First frame: full paint at cell resolution, then scaled.
+        cells = np.empty((self.Nrow * Ncol, 3), dtype=np.uint8)
+        cells[:] = self.void_color
+        cells[count > 0] = self.snake_color
+        cells[heads[0]] = self.snake_head_color
+        cells[self.forbidden] = self.forbidden_color
+        cells[fruits[0]] = self.fruit_color
+        cells = cells.reshape(self.Nrow, Ncol, 3)
+        s = self.scale
+        out[0] = np.repeat(np.repeat(cells, s, axis=0), s, axis=1)
+
+        for t in range(1, T):
+            frame = out[t]
+            frame[:] = out[t - 1]
+            head = path[t + 1]
+            fruit = fruits[t]
+            changed = [path[t], head, fruits[t - 1], fruit]
+            count[head] += 1
+            for k in range(tails[t - 1], tails[t]):
+                count[path[k]] -= 1
+                changed.append(path[k])
+            for pos in changed:
+                self._paint(frame, pos, self._cell_color(pos, head, fruit, count))
+        return out
+
+    def render_recording(self, recording, episode=None, out=None):
+        """
+        Renders an episode of a recording.
+
+        Parameters
+        ----------
+        recording : EpisodeRecorder or dict
+            A recorder (its steps in memory) or the output of `load_recording`.
+        episode : int, optional
+            The episode number. Default is None: the last recorded episode.
+        out : numpy.ndarray or str, optional
+            See `render`.
+
+        Returns
+        -------
+        numpy.ndarray
+            The (T, H, W, 3) uint8 frames.
+        """
+        if isinstance(recording, EpisodeRecorder):
+            get = recording.get
+        else:
+            # load_recording gives the chunks of each column, concatenated unless mmap_mode is set.
+            get = lambda column: (
+                recording[column]
+                if isinstance(recording[column], np.ndarray)
+                else np.concatenate(recording[column])
+            )
+        episodes = get("episode")
+        if episode is None:
+            episode = episodes[-1]
+        (ids,) = np.nonzero(episodes == episode)
+        return self.render(
+            get("head")[ids], get("fruit")[ids], get("length")[ids], out=out
+        )
+
+
+def export_frames(frames, path, duration=100):
+    """
+    Writes frames as an animated GIF if path ends with ".gif", else as a sequence of PNG files
+    in the path directory. Needs Pillow.
+
+    Parameters
+    ----------
+    frames : numpy.ndarray
+        The (T, H, W, 3) uint8 frames, for example from `FrameRenderer.render`.
+    path : str
+        The GIF file or PNG directory.
+    duration : int, optional
+        The GIF frame duration in milliseconds. Default is 100.
+    """
+    from PIL import Image
+
+    images = [Image.fromarray(np.ascontiguousarray(frame)) for frame in frames]
+    if path.endswith(".gif"):
+        images[0].save(
+            path, save_all=True, append_images=images[1:], duration=duration, loop=0
+        )
+    else:
+        os.makedirs(path, exist_ok=True)
+        for t, image in enumerate(images):
+            image.save(os.path.join(path, f"frame_{t:06d}.png"))
+
+
+def show_gui(snake, ax, return_metrics=False):
+    # RELATIVE TURNS
+
+    left_widget = widgets.Button(
+        description="snake.turn(+1)",
+        disabled=False,
+        button_style="success",
+        tooltip="Want to go left ?",
+        icon="fa-arrow-left",
+    )
+
+    right_widget = widgets.Button(
+        description="snake.turn(-1)",
+        disabled=False,
+        button_style="success",
+        tooltip="Want to go right ?",
+        icon="fa-arrow-right",
+    )
+
+    up_widget = widgets.Button(
+        description="snake.turn(0)",
+        disabled=False,
+        button_style="success",
+        tooltip="Want to go up ?",
+        icon="fa-arrow-up",
+    )
+
+    reset_widget = widgets.Button(
+        description="Reset",
+        disabled=False,
+        button_style="danger",
+        tooltip="Want to reset ?",
+        icon="fa-power-off",
+    )
+
+    # direction = 0
+
+    def select_sensors_method(method):
+        snake.recorded_sensors_method = method
+        print(f"Selected method {method}")
+
+    def set_turn(turn):
+        snake.turn(turn)
+        # print(snake.sensors(method="label"))
+        update_fig()
+
+    def reset_game():
+        snake.reset()
+        update_fig()
+
+    left_widget.on_click(lambda arg: set_turn(1.0))
+    right_widget.on_click(lambda arg: set_turn(-1.0))
+    up_widget.on_click(lambda arg: set_turn(0.0))
+    reset_widget.on_click(lambda arg: reset_game())
+
+    def update_fig():
+        im.set_array(snake.grid)
+        status = snake.status
+        if status == 0:
+            mess = "PLAY"
+        elif status == -1:
+            mess = "YOU DIED (YOURSELF)"
+        elif status == -2:
+            mess = "YOU DIED (LAVA)"
+        sensor_method = snake.display_sensor_method
+        if sensor_method == None:
+            sensors = ""
+        else:
+            sensors = str(snake.sensors(method=sensor_method))
+        title.set_text(f"Score = {snake.score}, {mess} {sensors}")
+        plt.draw()
+        return (im,)
+
+    ax.axis("off")
+    title = ax.set_title(f"Score = {snake.score}, PLAY ")
+    im = ax.imshow(snake.grid, interpolation="nearest", animated=True)
+    update_fig()
+    box = widgets.Box([left_widget, right_widget, up_widget, reset_widget])
+    # Add a standalone legend  gray box = head, black box = body, red box = wall, green box = fruit
+    entries = {"Head": "gray", "Body": "black", "Wall": "red", "Fruit": "green"}
+
+    f = lambda m, c: ax.plot([], [], marker=m, color=c, ls="none")[0]
+    handles = [f("s", val) for key, val in entries.items()]
+    labels = [key for key, val in entries.items()]
+    ax.legend(handles, labels, loc=(1.1, 0), framealpha=1, frameon=False)
+
+    return box
+
+    def show_record(self):
+        """
+        Show the recorded sensors and turns
+        """
+        pass
+
+
+class NeuralAgent:
+    """
+    A NEURAL NETWORK AGENT
+    """
+
+    def __init__(self, weights, structure, neural_functions, bias=False):
+        matrices = []
+        start = 0
         for i in range(len(structure) - 1):
             nin = structure[i]
             nout = structure[i + 1]
@@ -907,16 +2040,1322 @@ class NeuralAgent:
         self.matrices = matrices
         self.neural_functions = neural_functions
         self.weights = weights
+        self.bias = bias
 
     def get_caller(self):
         matrices = self.matrices
         neural_functions = self.neural_functions
+        bias = self.bias
 
         def inference(x):
             for stage in range(len(matrices)):
                 A, B = matrices[stage]
-                x = A @ x  # + B # No bias
+                x = A @ x
+                if bias:
+                    x = x + B
                 x = neural_functions[stage](x)
             return x
 
         return inference
+
+
+def count_weights(structure):
+    """
+    Returns the number of weights (biases included) of a network structure.
+    """
+    return sum((structure[i] + 1) * structure[i + 1] for i in range(len(structure) - 1))
+
+
+class NeuralPopulation:
+    """
+    A POPULATION OF NEURAL NETWORK AGENTS EVALUATED TOGETHER
+
+    The layers of all the agents are stacked (Npop, nout, nin) views of the (Npop, Nw) weight
+    matrix, with the same layout as `NeuralAgent`, so that each layer is one batched matmul.
+
+    Parameters
+    ----------
+    weights : ndarray
+        The (Npop, Nw) weights of the population, one row per agent.
+    structure : sequence of int
+        The number of neurons of each layer.
+    neural_functions : sequence of callable
+        The activation function of each layer.
+    bias : bool, optional
+        Whether to add the bias terms. Default is False, as in `NeuralAgent`.
+    """
+
+    def __init__(self, weights, structure, neural_functions, bias=False):
+        weights = np.asarray(weights)
+        Npop, Nw = weights.shape
+        if Nw != count_weights(structure):
+            raise ValueError(
+                f"Expected {count_weights(structure)} weights per agent, got {Nw}."
+            )
+        matrices = []
+        start = 0
+        for i in range(len(structure) - 1):
+            nin = structure[i]
+            nout = structure[i + 1]
+            A = weights[:, start : start + nin * nout].reshape(Npop, nout, nin)
+            B = weights[:, start + nin * nout : start + (nin + 1) * nout]
+            start += (nin + 1) * nout
+            matrices.append([A, B])
+        self.Npop = Npop
+        self.structure = structure
+        self.matrices = matrices
+        self.neural_functions = neural_functions
+        self.weights = weights
+        self.bias = bias
+
+    def __len__(self):
+        return self.Npop
+
+    def get_agent(self, agent_id):
+        """
+        Returns the NeuralAgent of a given individual.
+        """
+        return NeuralAgent(
+            self.weights[agent_id], self.structure, self.neural_functions, self.bias
+        )
+
+    def inference(self, x):
+        """
+        Runs all the agents on their own inputs.
+
+        Parameters
+        ----------
+        x : ndarray
+            A (Npop, nin) array, or (Npop, ..., nin) to evaluate each agent on several inputs
+            (for example one per try).
+
+        Returns
+        -------
+        ndarray
+            The (Npop, ..., nout) outputs.
+        """
+        x = np.asarray(x)
+        shape = x.shape[:-1]
+        x = x.reshape(self.Npop, -1, x.shape[-1])
+        for stage, (A, B) in enumerate(self.matrices):
+            x = np.matmul(x, A.swapaxes(1, 2))
+            if self.bias:
+                x = x + B[:, np.newaxis]
+            x = self.neural_functions[stage](x)
+        return x.reshape(shape + (x.shape[-1],))
+
+    def get_turns(self, x, turn_ids=(-1, 0, 1)):
+        """
+        Returns the turn chosen by each agent: the turn id of its first maximum output.
+        """
+        return np.asarray(turn_ids)[np.argmax(self.inference(x), axis=-1)]
+
+
+# POLICY COMPILATION
+DISCRETE_SENSOR_METHODS = ("default", "label")
+
+SENSOR_CODE_WEIGHTS = 3 ** np.arange(4, -1, -1)
+
+
+def sensor_codes(sensors):
+    """
+    Returns the state codes of discrete sensor readings (methods "default" and "label", each
+    value in {-1, 0, 1}): the base 3 numbers of their values + 1, in [0, 243).
+
+    Parameters
+    ----------
+    sensors : array_like
+        A (..., 5) array of sensor readings.
+
+    Returns
+    -------
+    ndarray
+        The (...) integer codes.
+    """
+    return (np.asarray(sensors) + 1.0).astype(np.intp) @ SENSOR_CODE_WEIGHTS
+
+
+@lru_cache(maxsize=None)
+def discrete_sensor_states():
+    """
+    Returns the (243, 5) discrete sensor readings, the row i being the readings of code i (see
+    `sensor_codes`). The returned array is shared between calls and must not be modified.
+    """
+    return np.array(list(itertools.product((-1.0, 0.0, 1.0), repeat=5)))
+
+
+class CompiledAgent:
+    """
+    AN AGENT COMPILED INTO A LOOKUP TABLE
+
+    The turn chosen by an agent in every discrete sensor state (see `sensor_codes`) is computed
+    once, so that each decision is a single table lookup. Compiled agents are equal, and hash
+    equally, when their tables are: they then play exactly the same games.
+
+    Parameters
+    ----------
+    turns : array_like
+        The (243,) turns (-1, 0 or 1) indexed by state code.
+    """
+
+    def __init__(self, turns):
+        self.turns = np.asarray(turns, dtype=np.int8)
+        self._turns = self.turns.tolist()
+
+    @classmethod
+    def from_agent(cls, agent, turn_ids=(-1, 0, 1)):
+        """
+        Compiles a NeuralAgent, or a function mapping the sensors to the outputs of the turns,
+        with the decision rule of `play_agent` (the turn of the first maximum output).
+        """
+        func = agent.get_caller() if isinstance(agent, NeuralAgent) else agent
+        turn_ids = np.asarray(turn_ids)
+        return cls([turn_ids[arg_max(func(x))] for x in discrete_sensor_states()])
+
+    def get_turn(self, sensors):
+        """
+        Returns the turn of a (5,) sensor reading.
+        """
+        a, b, c, d, e = sensors.tolist()
+        return self._turns[int(81.0 * a + 27.0 * b + 9.0 * c + 3.0 * d + e) + 121]
+
+    def get_turns(self, sensors):
+        """
+        Returns the turns of a (..., 5) array of sensor readings.
+        """
+        return self.turns[sensor_codes(sensors)]
+
+    def get_caller(self):
+        """
+        Returns a function mapping the sensors to one-hot outputs of the turns (-1, 0, 1), to be
+        used as a NeuralAgent caller.
+        """
+        outputs = np.eye(3)[self.turns + 1]
+        weights = SENSOR_CODE_WEIGHTS
+
+        def inference(x):
+            return outputs[(x + 1.0).astype(np.intp) @ weights]
+
+        return inference
+
+    def key(self):
+        """
+        Returns the bytes of the table, which identify the policy.
+        """
+        return self.turns.tobytes()
+
+    def __eq__(self, other):
+        return isinstance(other, CompiledAgent) and np.array_equal(
+            self.turns, other.turns
+        )
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+def compile_population(population, turn_ids=(-1, 0, 1)):
+    """
+    Returns the (Npop, 243) turn tables of a NeuralPopulation, computed with its batched
+    inference (see `CompiledAgent`).
+    """
+    states = discrete_sensor_states()
+    x = np.broadcast_to(states, (len(population),) + states.shape)
+    return population.get_turns(x, turn_ids).astype(np.int8)
+
+
+# NEURAL FUNCTIONS
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def ReLu(x):
+    return np.where(x > 0.0, x, 0.0)
+
+
+def identity(x):
+    return x
+
+
+def arg_max(x):
+    return int(np.where(x == x.max())[0][0])
+
+
+# GENETIC ALGORITHM OPERATORS
+def default_fitness(scores, turns):
+    """
+    The performance of the agents: 100 points per fruit minus one per turn.
+    """
+    return scores * 100 - turns
+
+
+def truncation_selection(perf, n_keep):
+    """
+    Returns the indices of the n_keep best individuals, best first.
+    """
+    return np.argsort(perf)[::-1][:n_keep]
+
+
+def blend_crossover(parents, n_children, rng):
+    """
+    Returns n_children individuals, each one a random weighted average of two distinct parents
+    (the same parent twice if there is only one), drawn from the numpy Generator rng.
+    """
+    n_parents, Nw = parents.shape
+    first = rng.integers(n_parents, size=n_children)
+    second = (first + rng.integers(1, max(n_parents, 2), size=n_children)) % n_parents
+    pw = rng.random((n_children, Nw))
+    return parents[first] * pw + (1.0 - pw) * parents[second]
+
+
+def gaussian_mutation(children, mutation_ratio, mutation_sigma, rng):
+    """
+    Multiplies a mutation_ratio share of the children by gaussian noise centered on 1, in place.
+    """
+    mutants = rng.random(len(children)) <= mutation_ratio
+    children[mutants] *= rng.normal(
+        loc=1.0, scale=mutation_sigma, size=(mutants.sum(), children.shape[1])
+    )
+    return children
+
+
+# GENETIC ALGORITHM EVALUATION
+def play_agent(
+    snake,
+    agent_func,
+    sensor_method="default",
+    max_turns=600,
+    first_fruit_position=None,
+    rng=None,
+):
+    """
+    Plays one game of a FastSnake with an agent function mapping sensors to the outputs of the
+    turns (-1, 0, 1), or with a CompiledAgent. The game is reset with the random stream rng if
+    given.
+
+    A game ended by the stall check of the snake (see `FastSnake`) is counted as played up to
+    max_turns with its final score: with the "cycle" check, the results are the same as without.
+
+    Returns
+    -------
+    score : int
+        The final score.
+    turns : int
+        The number of turns played.
+    """
+    turn_ids = np.array([-1.0, 0.0, 1.0])
+    snake.reset(rng=rng)
+    if first_fruit_position is not None:
+        snake.fruit_position = first_fruit_position
+    turn = 0
+    if isinstance(agent_func, CompiledAgent):
+        if sensor_method not in DISCRETE_SENSOR_METHODS:
+            raise ValueError(
+                f"Compiled agents need discrete sensors, got {sensor_method!r}."
+            )
+        get_turn = agent_func.get_turn
+    else:
+
+        def get_turn(sensors):
+            return turn_ids[arg_max(agent_func(sensors))]
+
+    while snake.status == 0:
+        snake.turn(get_turn(snake.sensors(method=sensor_method)))
+        turn += 1
+        if turn >= max_turns:
+            break
+    if snake.status == STALLED:
+        turn = max_turns
+    return snake.score, turn
+
+
+def get_game_seeds(config, generation, agent_ids):
+    """
+    Returns the (n_agents, Ntries) SeedSequences of the games played by some agents at a given
+    generation: keyed by (generation, agent, trial), or only by trial when config["common_games"]
+    is set so that all the agents play the same games at every generation.
+    """
+    seed = config["seed"]
+    if config["common_games"]:
+        trials = [game_seed(seed, trial) for trial in range(config["Ntries"])]
+        return [trials for agent_id in agent_ids]
+    return [
+        [
+            game_seed(seed, generation, agent_id, trial)
+            for trial in range(config["Ntries"])
+        ]
+        for agent_id in agent_ids
+    ]
+
+
+def evaluate_agents(
+    weights, config, snake=None, generation=0, agent_offset=0, agent_ids=None
+):
+    """
+    Plays config["Ntries"] games with each agent of a weight matrix.
+
+    With config["batched"], all the games are played together on a BatchSnake with a
+    NeuralPopulation, otherwise one after the other on a FastSnake (`snake` if given). Each game
+    has its own random stream (see `get_game_seeds`), so the results do not depend on how the
+    population is split between workers. agent_offset is the index of the first agent in the
+    population, agent_ids (default agent_offset, agent_offset + 1, ...) the index of each
+    agent. With config["compiled"], the agents are first compiled into lookup tables (see
+    `CompiledAgent`), which needs a discrete sensor method.
+
+    Returns
+    -------
+    scores, turns : ndarray
+        The mean score and number of turns of each agent.
+    """
+    Ntries = config["Ntries"]
+    n_agents = len(weights)
+    if agent_ids is None:
+        agent_ids = range(agent_offset, agent_offset + n_agents)
+    seeds = get_game_seeds(config, generation, agent_ids)
+    compiled = config.get("compiled", False)
+    if compiled and config["sensor_method"] not in DISCRETE_SENSOR_METHODS:
+        raise ValueError(
+            f"Compiled agents need discrete sensors, got {config['sensor_method']!r}."
+        )
+    population = NeuralPopulation(
+        weights, config["structure"], config["neural_functions"], config["bias"]
+    )
+    if compiled:
+        tables = compile_population(population)
+    if config["batched"]:
+        if compiled:
+            rows = np.repeat(np.arange(n_agents), Ntries)
+        batch = BatchSnake(
+            n_games=n_agents * Ntries,
+            rngs=[seed for agent_seeds in seeds for seed in agent_seeds],
+            **config["snake_kwargs"],
+        )
+        if config["first_fruit_position"] is not None:
+            batch.fruit_position[:] = config["first_fruit_position"]
+        for turn in range(config["max_turns"]):
+            if (batch.status != 0).all():
+                break
+            sensors = batch.sensors(config["sensor_method"])
+            if compiled:
+                batch.step(tables[rows, sensor_codes(sensors)])
+            else:
+                batch.step(
+                    population.get_turns(sensors.reshape(n_agents, Ntries, -1)).ravel()
+                )
+        scores = batch.score.reshape(n_agents, Ntries).mean(axis=1)
+        turns = np.where(batch.status == STALLED, config["max_turns"], batch.iteration)
+        turns = turns.reshape(n_agents, Ntries).mean(axis=1)
+        return scores, turns
+
+    if snake is None:
+        snake = FastSnake(**config["snake_kwargs"])
+    scores = np.zeros(n_agents)
+    turns = np.zeros(n_agents)
+    for agent_id in range(n_agents):
+        if compiled:
+            agent_func = CompiledAgent(tables[agent_id])
+        else:
+            agent_func = population.get_agent(agent_id).get_caller()
+        for trial in range(Ntries):
+            score, turn = play_agent(
+                snake,
+                agent_func,
+                config["sensor_method"],
+                config["max_turns"],
+                config["first_fruit_position"],
+                seeds[agent_id][trial],
+            )
+            scores[agent_id] += score / Ntries
+            turns[agent_id] += turn / Ntries
+    return scores, turns
+
+
+def _update_function_hash(h, value):
+    """
+    Updates the hash h with what defines the behavior of a function: the bytecode, constants and
+    names of its code, its defaults and its closure values. The other callables, such as the
+    numpy ufuncs, are identified by their qualified name.
+    """
+    if isinstance(value, types.FunctionType):
+        _update_function_hash(h, value.__code__)
+        for v in value.__defaults__ or ():
+            _update_function_hash(h, v)
+        for cell in value.__closure__ or ():
+            _update_function_hash(h, cell.cell_contents)
+    elif isinstance(value, types.CodeType):
+        h.update(value.co_code)
+        h.update(repr(value.co_names).encode())
+        for const in value.co_consts:
+            _update_function_hash(h, const)
+    elif isinstance(value, partial):
+        for v in (value.func,) + value.args + tuple(sorted(value.keywords.items())):
+            _update_function_hash(h, v)
+    elif isinstance(value, np.ndarray):
+        h.update(repr((value.dtype.str, value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif callable(value):
+        name = getattr(value, "__qualname__", getattr(value, "__name__", repr(value)))
+        h.update(f"{getattr(value, '__module__', None)}.{name}".encode())
+    else:
+        h.update(repr(value).encode())
+
+
+def fitness_keys(weights, config, generation=0, agent_ids=None):
+    """
+    Returns the `FitnessCache` keys of the evaluations of agents by `evaluate_agents`.
+
+    A key is a hash of everything the results depend on: the policy (the lookup table with
+    config["compiled"], so that agents behaving the same share their key, otherwise the weights
+    and the network, its activation functions being hashed from their code), the game settings
+    and the seeds of the games (see `get_game_seeds`). The batched and sequential evaluations
+    give the same results and share their keys.
+
+    Returns
+    -------
+    list of str
+        The key of each agent.
+    """
+    weights = np.asarray(weights)
+    n_agents = len(weights)
+    if agent_ids is None:
+        agent_ids = range(n_agents)
+    games = repr(
+        (
+            sorted(config["snake_kwargs"].items()),
+            config["sensor_method"],
+            config["max_turns"],
+            config["first_fruit_position"],
+        )
+    ).encode()
+    if config.get("compiled", False):
+        policies = compile_population(
+            NeuralPopulation(
+                weights, config["structure"], config["neural_functions"], config["bias"]
+            )
+        )
+        network = b""
+    else:
+        policies = weights
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((list(config["structure"]), config["bias"])).encode())
+        for f in config["neural_functions"]:
+            _update_function_hash(h, f)
+        network = h.digest()
+    keys = []
+    for policy, agent_seeds in zip(
+        policies, get_game_seeds(config, generation, agent_ids)
+    ):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.ascontiguousarray(policy).tobytes())
+        h.update(network)
+        h.update(games)
+        h.update(repr([(s.entropy, s.spawn_key) for s in agent_seeds]).encode())
+        keys.append(h.hexdigest())
+    return keys
+
+
+class FitnessCache:
+    """
+    A MEMO OF AGENT EVALUATIONS
+
+    Maps `fitness_keys` to the (score, turns) results of `evaluate_agents`, so that the agents
+    playing games already played by the same policy (kept elites with config["common_games"],
+    clones, agents with the same compiled table) are not evaluated again. The most recently
+    used max_size results are kept in memory, all of them in an SQLite database if path is
+    given, which makes the cache last between runs.
+
+    Parameters
+    ----------
+    max_size : int, optional
+        The number of results kept in memory. Default is 2**16.
+    path : str, optional
+        The SQLite database file. Default is None (memory only).
+
+    Attributes
+    ----------
+    hits, misses : int
+        The number of lookups answered or not by the cache.
+    """
+
+    def __init__(self, max_size=2**16, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS fitness (key TEXT PRIMARY KEY, score REAL, turns REAL)"
+            )
+
+    def __len__(self):
+        return len(self.data)
+
+    def _remember(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def get(self, key):
+        """
+        Returns the (score, turns) of a key, or None if unknown.
+        """
+        value = self.data.get(key)
+        if value is not None:
+            self.data.move_to_end(key)
+        elif self.db is not None:
+            row = self.db.execute(
+                "SELECT score, turns FROM fitness WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                value = row
+                self._remember(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Stores the (score, turns) of a key.
+        """
+        value = (float(value[0]), float(value[1]))
+        self._remember(key, value)
+        if self.db is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO fitness VALUES (?, ?, ?)", (key,) + value
+            )
+
+    def evaluate(self, keys, evaluate):
+        """
+        Returns the scores and turns of the agents of given keys.
+
+        evaluate(ids) returns the scores and turns of the agents of indices ids. It is called once,
+        on the first agent of each key missing from the cache.
+        """
+        values = {}
+        missing = {}
+        for i, key in enumerate(keys):
+            if key in values or key in missing:
+                self.hits += 1
+                continue
+            value = self.get(key)
+            if value is None:
+                missing[key] = i
+            else:
+                values[key] = value
+        if missing:
+            ids = np.fromiter(missing.values(), dtype=np.intp, count=len(missing))
+            scores, turns = evaluate(ids)
+            for key, score, turn in zip(missing, scores, turns):
+                self.put(key, (score, turn))
+                values[key] = (float(score), float(turn))
+            if self.db is not None:
+                self.db.commit()
+        out = np.array([values[key] for key in keys], dtype=np.float64).reshape(-1, 2)
+        return out[:, 0], out[:, 1]
+
+    def stats(self):
+        """
+        Returns the hits, misses, hit rate and number of results in memory.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.data),
+        }
+
+    def close(self):
+        """
+        Closes the database, if any.
+        """
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+
+_worker = {}
+
+
+def _init_worker(shm_name, shape, config):
+    """
+    Attaches a pool worker to the shared weights and builds its own FastSnake.
+    """
+    # The workers share the resource tracker of the trainer process, which unlinks the segment.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker["shm"] = shm
+    _worker["weights"] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker["config"] = config
+    _worker["snake"] = FastSnake(**config["snake_kwargs"])
+
+
+def _evaluate_worker_chunk(agent_ids, generation):
+    return evaluate_agents(
+        _worker["weights"][agent_ids],
+        _worker["config"],
+        _worker["snake"],
+        generation,
+        agent_ids=agent_ids,
+    )
+
+
+class GeneticTrainer:
+    """
+    A GENETIC ALGORITHM TRAINER FOR NEURAL SNAKE AGENTS
+
+    Each generation, all the agents are evaluated on Ntries games, the best ones are kept and the
+    rest of the population is replaced by mutated crossovers of them. The evaluation is spread over
+    a pool of worker processes, each one owning its FastSnake and reading the population weights
+    from shared memory, so that only chunk bounds and results are sent between processes.
+
+    Parameters
+    ----------
+    structure : sequence of int
+        The network structure, see `NeuralAgent`.
+    neural_functions : sequence of callable
+        The activation function of each layer. They must be picklable when the workers are not
+        forked (module level functions such as `identity`).
+    Npop : int
+        The number of individuals in the population.
+    Ntries : int
+        The number of games played by each individual per generation.
+    max_turns : int
+        The maximum number of turns per game.
+    sensor_method : str
+        The sensor method given to `FastSnake.sensors`.
+    keep_ratio : float
+        The share of the population kept for the next generation.
+    mutation_ratio : float
+        The probability for a child to be mutated.
+    mutation_sigma : float
+        The standard deviation of the mutation noise.
+    selection : callable
+        `selection(perf, n_keep)` returns the kept individuals, best first.
+    crossover : callable
+        `crossover(parents, n_children, rng)` returns the new individuals.
+    mutation : callable
+        `mutation(children, mutation_ratio, mutation_sigma, rng)` mutates the new individuals.
+    fitness : callable
+        `fitness(scores, turns)` returns the performance of the individuals.
+    snake_kwargs : dict, optional
+        The FastSnake parameters. Default is a 10 x 10 grid.
+    first_fruit_position : int, optional
+        A fixed position for the first fruit of each game.
+    bias : bool
+        Whether the agents use their bias terms.
+    weights : ndarray, optional
+        The (Npop, Nw) initial population. Default is uniform in [-1, 1].
+    n_workers : int, optional
+        The number of worker processes. Default is the number of CPUs, 0 or 1 evaluates in the
+        current process.
+    batched : bool
+        Whether each chunk of agents plays all its games together on a BatchSnake.
+    chunk_size : int, optional
+        The number of agents per task. Default splits the population in one task per worker when
+        batched, 4 otherwise.
+    seed : int, optional
+        The root seed of the run: the genetic operators and every game draw from streams derived
+        from it, which makes runs reproducible whatever the number of workers. Default is a fresh
+        random seed, stored in the `seed` attribute.
+    common_games : bool
+        Whether all the agents play the same Ntries games at every generation.
+    compiled : bool
+        Whether the agents are compiled into lookup tables before playing (see
+        `CompiledAgent`), which needs a discrete sensor method ("default" or "label").
+    cache : FitnessCache or bool, optional
+        A cache of the evaluations, True for a new in-memory one: the agents whose games were
+        already played by the same policy are not evaluated again. It hits when the games repeat,
+        that is with common_games. Default is None.
+    """
+
+    def __init__(
+        self,
+        structure,
+        neural_functions,
+        Npop=100,
+        Ntries=1,
+        max_turns=600,
+        sensor_method="default",
+        keep_ratio=0.2,
+        mutation_ratio=0.1,
+        mutation_sigma=1.0,
+        selection=truncation_selection,
+        crossover=blend_crossover,
+        mutation=gaussian_mutation,
+        fitness=default_fitness,
+        snake_kwargs=None,
+        first_fruit_position=None,
+        bias=False,
+        weights=None,
+        n_workers=None,
+        batched=False,
+        chunk_size=None,
+        seed=None,
+        common_games=False,
+        compiled=False,
+        cache=None,
+    ):
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+        self.rng = np.random.default_rng(np.random.SeedSequence(seed))
+        if snake_kwargs is None:
+            snake_kwargs = {"Nrow": 10, "Ncol": 10}
+        if n_workers is None:
+            n_workers = os.cpu_count()
+        self.Npop = Npop
+        self.Nw = Nw = count_weights(structure)
+        self.keep_individuals = max(int(keep_ratio * Npop), 1)
+        self.mutation_ratio = mutation_ratio
+        self.mutation_sigma = mutation_sigma
+        self.selection = selection
+        self.crossover = crossover
+        self.mutation = mutation
+        self.fitness = fitness
+        self.n_workers = n_workers
+        if chunk_size is None:
+            # Batched chunks are faster when large, FastSnake chunks balance better when small.
+            n_chunks = max(n_workers, 1) * (1 if batched else 4)
+            chunk_size = -(-Npop // n_chunks)
+        self.chunk_size = chunk_size
+        self.config = {
+            "structure": structure,
+            "neural_functions": neural_functions,
+            "Ntries": Ntries,
+            "max_turns": max_turns,
+            "sensor_method": sensor_method,
+            "snake_kwargs": snake_kwargs,
+            "first_fruit_position": first_fruit_position,
+            "bias": bias,
+            "batched": batched,
+            "seed": seed,
+            "common_games": common_games,
+            "compiled": compiled,
+        }
+
+        # The population lives in shared memory, updated in place at each generation.
+        self._shm = shared_memory.SharedMemory(create=True, size=Npop * Nw * 8)
+        self.weights = np.ndarray((Npop, Nw), dtype=np.float64, buffer=self._shm.buf)
+        if weights is None:
+            weights = (self.rng.random((Npop, Nw)) - 0.5) * 2.0
+        self.weights[:] = weights
+        self._executor = None
+        if cache is True:
+            cache = FitnessCache()
+        self.cache = cache
+        self.generation = 0
+        self.scores = np.zeros(Npop)
+        self.turns = np.zeros(Npop)
+        self.perf = np.zeros(Npop)
+        self.history = []
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                initializer=_init_worker,
+                initargs=(self._shm.name, self.weights.shape, self.config),
+            )
+        return self._executor
+
+    def evaluate(self):
+        """
+        Evaluates the current population and returns its performance.
+        """
+        if self.cache is None:
+            self.scores[:], self.turns[:] = self._evaluate(np.arange(self.Npop))
+        else:
+            keys = fitness_keys(self.weights, self.config, self.generation)
+            self.scores[:], self.turns[:] = self.cache.evaluate(keys, self._evaluate)
+        self.perf[:] = self.fitness(self.scores, self.turns)
+        return self.perf
+
+    def _evaluate(self, agent_ids):
+        """
+        Returns the scores and turns of some agents of the current population.
+        """
+        if self.n_workers <= 1:
+            return evaluate_agents(
+                self.weights[agent_ids],
+                self.config,
+                generation=self.generation,
+                agent_ids=agent_ids,
+            )
+        scores = np.zeros(len(agent_ids))
+        turns = np.zeros(len(agent_ids))
+        bounds = range(0, len(agent_ids), self.chunk_size)
+        chunks = [agent_ids[start : start + self.chunk_size] for start in bounds]
+        generations = [self.generation] * len(chunks)
+        executor = self._get_executor()
+        for start, (chunk_scores, chunk_turns) in zip(
+            bounds, executor.map(_evaluate_worker_chunk, chunks, generations)
+        ):
+            scores[start : start + len(chunk_scores)] = chunk_scores
+            turns[start : start + len(chunk_turns)] = chunk_turns
+        return scores, turns
+
+    def step(self):
+        """
+        Evaluates the population and breeds the next generation.
+
+        Returns
+        -------
+        dict
+            The generation summary appended to `history`.
+        """
+        perf = self.evaluate()
+        order = self.selection(perf, self.keep_individuals)
+        keep = len(order)
+        new_weights = np.empty_like(self.weights)
+        new_weights[:keep] = self.weights[order]
+        children = self.crossover(new_weights[:keep], self.Npop - keep, self.rng)
+        new_weights[keep:] = self.mutation(
+            children, self.mutation_ratio, self.mutation_sigma, self.rng
+        )
+        summary = {
+            "generation": self.generation,
+            "best_score": self.scores[order[0]],
+            "best_turns": self.turns[order[0]],
+            "best_perf": perf[order[0]],
+            "mean_perf": perf.mean(),
+        }
+        self.history.append(summary)
+        self.weights[:] = new_weights
+        self.generation += 1
+        return summary
+
+    def run(self, Ngen, verbose=False):
+        """
+        Runs Ngen generations and returns the history.
+        """
+        for generation in range(Ngen):
+            summary = self.step()
+            if verbose:
+                print(
+                    f"Generation: {summary['generation']} => best score = {summary['best_score']}"
+                )
+        return self.history
+
+    def get_best_agent(self):
+        """
+        Returns the NeuralAgent of the best individual of the last evaluated generation, which is
+        kept first in the population.
+        """
+        config = self.config
+        return NeuralAgent(
+            self.weights[0].copy(),
+            config["structure"],
+            config["neural_functions"],
+            config["bias"],
+        )
+
+    def close(self):
+        """
+        Shuts the worker pool down and releases the shared memory.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._shm is not None:
+            weights = self.weights.copy()
+            self.weights = weights
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# VECTORIZED ENVIRONMENTS
+# Colors of the void, snake, head, forbidden and fruit cells, as in `FastSnake.get_grid`.
+GRID_PALETTE = np.array(
+    [(255, 255, 255), (0, 0, 0), (128, 128, 128), (255, 0, 0), (0, 255, 0)],
+    dtype=np.uint8,
+)
+
+
+def batch_grids(heads, occupancy, fruits, Nrow, Ncol, out=None):
+    """
+    Returns the RGB images of a batch of games, see `FastSnake.get_grid`.
+
+    Parameters
+    ----------
+    heads, occupancy, fruits : array_like
+        The (N,) head positions, (N, Ncell) occupancy and (N,) fruit positions.
+    Nrow, Ncol : int
+        The grid shape.
+    out : ndarray, optional
+        A (N, Nrow, Ncol, 3) uint8 array to write the images into.
+
+    Returns
+    -------
+    ndarray
+        The (N, Nrow, Ncol, 3) uint8 images.
+    """
+    games = np.arange(len(heads))
+    cells = np.where(np.asarray(occupancy) != 0, 1, 0).astype(np.uint8)
+    cells[games, heads] = 2
+    cells[:, get_forbidden_mask(Nrow, Ncol)] = 3
+    cells[games, fruits] = 4
+    return np.take(GRID_PALETTE, cells.reshape(-1, Nrow, Ncol), axis=0, out=out)
+
+
+class SnakeVectorEnv:
+    """
+    A VECTORIZED SNAKE ENVIRONMENT
+
+    n_envs games played together on a BatchSnake through a `reset()` / `step(actions)` interface.
+    The actions are the indices 0, 1, 2 of the turns right, forward and left (the outputs of the
+    agents). The finished games are reset automatically. The environment i draws its fruits from
+    its own stream `game_seed(seed, i)`, so that the games only depend on the seed.
+
+    The results are written in buffers allocated once (see `buffer_specs`) and returned as is:
+    they are overwritten at the next step.
+
+    Parameters
+    ----------
+    n_envs : int
+        The number of environments.
+    Nrow, Ncol : int, optional
+        The grid shape. Default is 10 x 10.
+    observation : str, optional
+        "sensors" (the `BatchSnake.sensors` readings) or "grid" (the `batch_grids` images).
+        Default is "sensors".
+    sensor_method : str, optional
+        The sensor method. Default is "default".
+    max_turns : int, optional
+        The number of turns after which an episode is truncated. Default is 600.
+    fruit_reward, death_reward, step_reward : float, optional
+        The reward of each fruit eaten, of a defeat and of each step. Default is 1, -1 and 0.
+    snake_kwargs : dict, optional
+        Other BatchSnake parameters, such as snake_max_length or stall_check.
+    buffers : dict, optional
+        The arrays to write the results into, see `buffer_specs`. Default allocates them.
+    env_ids : sequence of int, optional
+        The indices of the environments used for seeding. Default is range(n_envs).
+    """
+
+    def __init__(
+        self,
+        n_envs,
+        Nrow=10,
+        Ncol=10,
+        observation="sensors",
+        sensor_method="default",
+        max_turns=600,
+        fruit_reward=1.0,
+        death_reward=-1.0,
+        step_reward=0.0,
+        snake_kwargs=None,
+        buffers=None,
+        env_ids=None,
+    ):
+        if observation not in ("sensors", "grid"):
+            raise ValueError(f"Unknown observation {observation!r}.")
+        if snake_kwargs is None:
+            snake_kwargs = {}
+        if env_ids is None:
+            env_ids = range(n_envs)
+        self.n_envs = n_envs
+        self.Nrow = Nrow
+        self.Ncol = Ncol
+        self.observation = observation
+        self.sensor_method = sensor_method
+        self.max_turns = max_turns
+        self.fruit_reward = fruit_reward
+        self.death_reward = death_reward
+        self.step_reward = step_reward
+        self.env_ids = np.asarray(env_ids)
+        self.seed = None
+        self.episodes = np.zeros(n_envs, dtype=np.int64)
+        self.batch = BatchSnake(
+            Nrow,
+            Ncol,
+            n_envs,
+            rngs=[game_seed(0, env_id) for env_id in self.env_ids],
+            **snake_kwargs,
+        )
+        if buffers is None:
+            specs = self.buffer_specs(n_envs, Nrow, Ncol, observation, sensor_method)
+            buffers = {
+                name: np.zeros(shape, dtype) for name, (shape, dtype) in specs.items()
+            }
+        self.buffers = buffers
+
+    @staticmethod
+    def buffer_specs(
+        n_envs, Nrow=10, Ncol=10, observation="sensors", sensor_method="default"
+    ):
+        """
+        Returns the shape and dtype of each result buffer: observation and final_observation (the
+        last observation of the episodes that just ended), action, reward, done, truncated and
+        the score, turns and status of the current, or just ended, episodes.
+        """
+        if observation == "grid":
+            obs = ((n_envs, Nrow, Ncol, 3), np.uint8)
+        else:
+            obs = ((n_envs, 7 if sensor_method == "elidar" else 5), np.float64)
+        return {
+            "observation": obs,
+            "final_observation": obs,
+            "action": ((n_envs,), np.int64),
+            "reward": ((n_envs,), np.float64),
+            "done": ((n_envs,), np.bool_),
+            "truncated": ((n_envs,), np.bool_),
+            "score": ((n_envs,), np.int64),
+            "turns": ((n_envs,), np.int64),
+            "status": ((n_envs,), np.int64),
+        }
+
+    def _observe(self, envs, out):
+        batch = self.batch
+        if self.observation == "grid":
+            out[envs] = batch_grids(
+                batch.heads[envs],
+                batch.occupancy[envs],
+                batch.fruit_position[envs],
+                self.Nrow,
+                self.Ncol,
+            )
+        else:
+            out[envs] = batch_sensors(
+                batch.heads[envs],
+                batch.get_current_direction()[envs],
+                batch.occupancy[envs],
+                batch.fruit_position[envs],
+                self.Nrow,
+                self.Ncol,
+                method=self.sensor_method,
+            )
+
+    def _reset_envs(self, envs, rngs=None):
+        self.batch.reset_games(envs, rngs)
+        self._observe(envs, self.buffers["observation"])
+
+    def reset(self, seed=None):
+        """
+        Starts new episodes in all the environments and returns the observations. A seed gives
+        the environments new streams and restarts the episode counts, otherwise the streams go on.
+        """
+        envs = np.arange(self.n_envs)
+        rngs = None
+        if seed is not None or self.seed is None:
+            self.seed = np.random.SeedSequence().entropy if seed is None else seed
+            self.episodes[:] = 0
+            rngs = [game_seed(self.seed, env_id) for env_id in self.env_ids]
+        else:
+            self.episodes += 1
+        self._reset_envs(envs, rngs)
+        return self.buffers["observation"]
+
+    def step(self, actions):
+        """
+        Plays one turn in every environment and resets the finished ones.
+
+        Returns
+        -------
+        observation, reward, done : ndarray
+            The observations (of the new episodes for the finished ones), rewards and end flags.
+        info : dict
+            The truncated, score, turns, status and final_observation buffers.
+        """
+        batch = self.batch
+        buffers = self.buffers
+        score = batch.score.copy()
+        batch.turn(np.asarray(actions) - 1)
+        status = batch.status
+        reward = buffers["reward"]
+        reward[:] = self.step_reward + self.fruit_reward * (batch.score - score)
+        reward[(status < 0) & (status != STALLED)] += self.death_reward
+        truncated = buffers["truncated"]
+        truncated[:] = (status == 0) & (batch.iteration >= self.max_turns)
+        done = buffers["done"]
+        done[:] = (status != 0) | truncated
+        buffers["score"][:] = batch.score
+        buffers["turns"][:] = batch.iteration
+        buffers["status"][:] = status
+        envs = np.flatnonzero(done)
+        self._observe(np.flatnonzero(~done), buffers["observation"])
+        if envs.size:
+            self._observe(envs, buffers["final_observation"])
+            self.episodes[envs] += 1
+            self._reset_envs(envs)
+        info = {
+            name: buffers[name]
+            for name in ("truncated", "score", "turns", "status", "final_observation")
+        }
+        return buffers["observation"], reward, done, info
+
+
+def _vector_env_worker(conn, names, specs, start, stop, kwargs):
+    """
+    Runs a slice of the environments of an AsyncSnakeVectorEnv, on its shared buffers.
+    """
+    shms = [shared_memory.SharedMemory(name=name) for name in names]
+    buffers = {
+        key: np.ndarray(shape, dtype=dtype, buffer=shm.buf)[start:stop]
+        for shm, (key, (shape, dtype)) in zip(shms, specs.items())
+    }
+    env = SnakeVectorEnv(
+        stop - start, buffers=buffers, env_ids=range(start, stop), **kwargs
+    )
+    try:
+        while True:
+            command, arg = conn.recv()
+            if command == "close":
+                break
+            try:
+                if command == "reset":
+                    env.reset(arg)
+                elif command == "step":
+                    env.step(buffers["action"])
+                conn.send(None)
+            except Exception as error:
+                conn.send(error)
+    finally:
+        del buffers, env
+        for shm in shms:
+            shm.close()
+        conn.close()
+
+
+class AsyncSnakeVectorEnv:
+    """
+    A VECTORIZED SNAKE ENVIRONMENT RUN BY WORKER PROCESSES
+
+    The environments of a `SnakeVectorEnv` split between n_workers processes, each one stepping its
+    slice. The actions and results are exchanged through buffers in shared memory, so that only
+    short commands go through the pipes. The games are the same as with a SnakeVectorEnv of the
+    same seed, whatever the number of workers.
+
+    Parameters
+    ----------
+    n_envs : int
+        The number of environments.
+    n_workers : int, optional
+        The number of worker processes. Default is the number of CPUs.
+    **kwargs
+        The other SnakeVectorEnv parameters.
+    """
+
+    def __init__(self, n_envs, n_workers=None, **kwargs):
+        if n_workers is None:
+            n_workers = os.cpu_count()
+        n_workers = max(min(n_workers, n_envs), 1)
+        self.n_envs = n_envs
+        self.n_workers = n_workers
+        self.seed = None
+        spec_kwargs = {
+            key: kwargs[key]
+            for key in ("Nrow", "Ncol", "observation", "sensor_method")
+            if key in kwargs
+        }
+        specs = SnakeVectorEnv.buffer_specs(n_envs, **spec_kwargs)
+        self._shms = []
+        self.buffers = {}
+        for name, (shape, dtype) in specs.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            self._shms.append(shm)
+            self.buffers[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        names = [shm.name for shm in self._shms]
+        bounds = np.linspace(0, n_envs, n_workers + 1).astype(int)
+        context = multiprocessing.get_context()
+        self._conns = []
+        self._processes = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_vector_env_worker,
+                args=(child_conn, names, specs, start, stop, kwargs),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._conns.append(conn)
+            self._processes.append(process)
+
+    def _call(self, command, arg=None):
+        for conn in self._conns:
+            conn.send((command, arg))
+
+    def _wait(self):
+        errors = [conn.recv() for conn in self._conns]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def reset(self, seed=None):
+        """
+        Starts new episodes in all the environments, see `SnakeVectorEnv.reset`.
+        """
+        if seed is None and self.seed is None:
+            seed = np.random.SeedSequence().entropy
+        if seed is not None:
+            self.seed = seed
+        self._call("reset", seed)
+        self._wait()
+        return self.buffers["observation"]
+
+    def step_async(self, actions):
+        """
+        Starts a step of all the workers, see `step_wait`.
+        """
+        self.buffers["action"][:] = actions
+        self._call("step")
+
+    def step_wait(self):
+        """
+        Waits for the workers and returns the results of the step, see `SnakeVectorEnv.step`.
+        """
+        self._wait()
+        buffers = self.buffers
+        info = {
+            name: buffers[name]
+            for name in ("truncated", "score", "turns", "status", "final_observation")
+        }
+        return buffers["observation"], buffers["reward"], buffers["done"], info
+
+    def step(self, actions):
+        """
+        Plays one turn in every environment, see `SnakeVectorEnv.step`.
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        """
+        Stops the workers and releases the shared memory.
+        """
+        if self._conns:
+            self._call("close")
+            for process in self._processes:
+                process.join()
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+            self._processes = []
+        if self._shms:
+            self.buffers = {
+                name: buffer.copy() for name, buffer in self.buffers.items()
+            }
+            for shm in self._shms:
+                shm.close()
+                shm.unlink()
+            self._shms = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -2,15 +2,41 @@
 # POINT MASS DYNAMICS
 # Author: Ludovic Charleux, ludovic.charleux@univ-smb.fr, 01/2018
 ################################################################################
+import json
+import os
+import time
+
 import numpy as np
-from scipy import integrate, optimize
+from scipy import integrate, interpolate, optimize
 from scipy.integrate import odeint
+from scipy.spatial import cKDTree
 
 
-def distances(P):
+def distances(P, out=None):
     """
     Return vectorials distance, scalar distance and normalized directions.
+    The (n, n, 2), (n, n) and (n, n, 2) arrays can be given as out=(D, R, U) to be filled
+    without any allocation, P and out having then optional leading batch axes.
     """
+    if out is not None:
+        D, R, U = out
+        D0, D1 = D[..., 0], D[..., 1]
+        U0, U1 = U[..., 0], U[..., 1]
+        # Broadcasting assignments, as broadcasting ufuncs allocate iteration buffers.
+        D0[:] = P[..., :, np.newaxis, 0]
+        R[:] = P[..., np.newaxis, :, 0]
+        np.subtract(D0, R, out=D0)
+        D1[:] = P[..., :, np.newaxis, 1]
+        R[:] = P[..., np.newaxis, :, 1]
+        np.subtract(D1, R, out=D1)
+        np.multiply(D, D, out=U)
+        np.add(U0, U1, out=R)
+        np.sqrt(R, out=R)
+        # The null vectors are divided by a tiny number instead of 0.
+        np.maximum(R, np.finfo(R.dtype).tiny, out=U0)
+        np.divide(D1, U0, out=U1)
+        np.divide(D0, U0, out=U0)
+        return D, R, U
     X, Y = P.T
     dX = X - X[:, np.newaxis]
     dY = Y - Y[:, np.newaxis]
@@ -22,43 +48,509 @@ def distances(P):
     return D, R, U
 
 
+def central_forces(f, U, out=None):
+    """
+    Returns the (n, 2) forces F[b] = sum_a f[a, b] U[a, b] of the pair intensities f
+    (positive = attractive), in out if given. Leading batch axes are supported.
+    """
+    return np.einsum("...ab,...abk->...bk", f, U, out=out)
+
+
+# Half stencil of the cell list: each pair of neighbor cells is visited once.
+CELL_OFFSETS = np.array([[0, 0], [1, -1], [1, 0], [1, 1], [0, 1]])
+
+
+def cell_list_pairs(P, cutoff):
+    """
+    Returns the indices (i, j) of the pairs closer than cutoff using a cell list.
+    """
+    P = np.asarray(P, dtype=np.float64)
+    cells = np.floor((P - P.min(axis=0)) / cutoff).astype(np.int64)
+    stride = cells[:, 1].max() + 3
+    keys = (cells[:, 0] + 1) * stride + cells[:, 1] + 1
+    order = np.argsort(keys, kind="stable")
+    skeys = keys[order]
+    I, J = [], []
+    for ox, oy in CELL_OFFSETS:
+        nkeys = skeys + ox * stride + oy
+        lo = np.searchsorted(skeys, nkeys, side="left")
+        hi = np.searchsorted(skeys, nkeys, side="right")
+        if ox == 0 and oy == 0:
+            lo = np.arange(len(P)) + 1
+        counts = np.maximum(hi - lo, 0)
+        total = counts.sum()
+        i = np.repeat(np.arange(len(P)), counts)
+        j = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(total)
+        I.append(i)
+        J.append(j)
+    i = order[np.concatenate(I)]
+    j = order[np.concatenate(J)]
+    d = P[j] - P[i]
+    keep = (d**2).sum(axis=1) < cutoff**2
+    return i[keep], j[keep]
+
+
+def pairs(P, cutoff, method="cells"):
+    """
+    Returns the pairs closer than cutoff as compact arrays (i, j, dx, dy, r), with i < j,
+    each pair appearing once and (dx, dy) = P[j] - P[i].
+    The method is "cells" (cell list) or "kdtree" (scipy.spatial.cKDTree).
+    """
+    P = np.asarray(P, dtype=np.float64)
+    if method == "cells":
+        i, j = cell_list_pairs(P, cutoff)
+    elif method == "kdtree":
+        ij = cKDTree(P).query_pairs(cutoff, output_type="ndarray")
+        i, j = ij[:, 0], ij[:, 1]
+    else:
+        raise ValueError(f"Unknown pairs method {method!r}.")
+    swap = i > j
+    i, j = np.where(swap, j, i), np.where(swap, i, j)
+    dx, dy = (P[j] - P[i]).T
+    r = np.sqrt(dx**2 + dy**2)
+    return i, j, dx, dy, r
+
+
+def all_pairs(P, ij=None):
+    """
+    Returns all the pairs as (i, j, dx, dy, r) arrays, see pairs. The triu_indices ij can be
+    given to avoid computing them again.
+    """
+    P = np.asarray(P, dtype=np.float64)
+    if ij is None:
+        ij = np.triu_indices(len(P), 1)
+    i, j = ij
+    dx, dy = (P[j] - P[i]).T
+    r = np.sqrt(dx**2 + dy**2)
+    return i, j, dx, dy, r
+
+
+def pair_sum(n, i, j, dx, dy, r, f):
+    """
+    Returns the (n, 2) forces of the pair forces of intensities f (positive = attractive).
+    """
+    f = np.divide(f, r, out=np.zeros_like(r), where=r != 0.0)
+    fx = f * dx
+    fy = f * dy
+    F = np.empty((n, 2))
+    F[:, 0] = np.bincount(i, fx, minlength=n) - np.bincount(j, fx, minlength=n)
+    F[:, 1] = np.bincount(i, fy, minlength=n) - np.bincount(j, fy, minlength=n)
+    return F
+
+
+class NeighborList:
+    """
+    Verlet neighbor list: keeps the pairs closer than cutoff + skin and rebuilds them only when
+    a particle has moved more than skin / 2 since the last build.
+    """
+
+    def __init__(self, cutoff, skin=0.3, method="cells"):
+        self.cutoff = cutoff
+        self.skin = skin
+        self.method = method
+        self.P0 = None
+        self.i = None
+        self.j = None
+        self.calls = 0
+        self.builds = 0
+        self.candidates = 0
+        self.n_pairs = 0
+
+    def needs_rebuild(self, P):
+        """
+        Returns True if the list is not valid anymore for the positions P.
+        """
+        if self.P0 is None or P.shape != self.P0.shape:
+            return True
+        displacement = ((P - self.P0) ** 2).sum(axis=1).max()
+        return displacement > (0.5 * self.skin) ** 2
+
+    def build(self, P):
+        """
+        Builds the list of the pairs closer than cutoff + skin.
+        """
+        self.P0 = np.array(P, dtype=np.float64)
+        self.i, self.j = pairs(self.P0, self.cutoff + self.skin, self.method)[:2]
+        self.builds += 1
+        self.candidates = len(self.i)
+
+    def __call__(self, P):
+        """
+        Returns the pairs closer than cutoff as (i, j, dx, dy, r), see pairs.
+        """
+        P = np.asarray(P, dtype=np.float64)
+        self.calls += 1
+        if self.needs_rebuild(P):
+            self.build(P)
+        i, j = self.i, self.j
+        dx, dy = (P[j] - P[i]).T
+        r = np.sqrt(dx**2 + dy**2)
+        keep = r < self.cutoff
+        self.n_pairs = int(keep.sum())
+        return i[keep], j[keep], dx[keep], dy[keep], r[keep]
+
+
+# Yoshida 4th order coefficients: drift (c) and kick (d) fractions of the time step.
+YOSHIDA_W1 = 1.0 / (2.0 - 2.0 ** (1.0 / 3.0))
+YOSHIDA_W0 = -(2.0 ** (1.0 / 3.0)) * YOSHIDA_W1
+YOSHIDA_C = np.array(
+    [YOSHIDA_W1 / 2.0, (YOSHIDA_W0 + YOSHIDA_W1) / 2.0]
+    + [(YOSHIDA_W0 + YOSHIDA_W1) / 2.0, YOSHIDA_W1 / 2.0]
+)
+YOSHIDA_D = np.array([YOSHIDA_W1, YOSHIDA_W0, YOSHIDA_W1])
+
+
 class PMD:
     """
     Point Mass Dynamics
+
+    The integrator is "odeint" (adaptive, scipy) or one of the fixed step symplectic
+    integrators "verlet" (velocity Verlet), "leapfrog" (drift-kick-drift) and "yoshida4".
+
+    The current state is kept apart from the history, a ring buffer of the last nk kept states,
+    one every decimation steps. The kept states can also be streamed to disk by a
+    TrajectoryWriter, see writer.
     """
 
-    def __init__(self, m, P, V, nk=10000):
-        n = len(P)
+    integrators = ("odeint", "verlet", "leapfrog", "yoshida4")
+
+    def __init__(self, m, P, V, nk=10000, integrator="odeint", decimation=1):
+        n = np.shape(P)[-2]
         self._n = n
-        self.X = np.zeros([nk, 4 * n])
-        self.X.fill(np.nan)
-        self.X[-1, : 2 * n] = np.array(P).flatten()
-        self.X[-1, 2 * n :] = np.array(V).flatten()
-        self.m = np.array(m)
+        self._state = self.pack_state(P, V)
+        self._X = np.empty([nk, len(self._state)])
+        self._X[0] = self._state
+        self._cursor = 0
+        self._filled = 1
+        self._step = 0
+        self.t = 0.0
+        self._writer = None
+        self.decimation = decimation
+        self.m = m
         self.nk = nk
+        self._workspace = None
+        self._dX = np.empty_like(self._state)
+        self._all_pairs = None
+        self.forces = []
+        self.neighbor_list = None
+        if integrator not in self.integrators:
+            raise ValueError(f"Unknown integrator {integrator!r}.")
+        self.integrator = integrator
+        self._A = np.zeros_like(self.split_state(self._state)[0])
+
+    def pack_state(self, P, V):
+        """
+        Returns the state vector [P.flatten(), V.flatten()].
+        """
+        n = self._n
+        state = np.zeros(4 * n)
+        state[: 2 * n] = np.array(P).flatten()
+        state[2 * n :] = np.array(V).flatten()
+        return state
+
+    def split_state(self, state):
+        """
+        Returns the positions and velocities views of a state vector.
+        """
+        n = self._n
+        return state[: 2 * n].reshape(n, 2), state[2 * n :].reshape(n, 2)
+
+    def solve(self, dt, nt, integrator=None):
+        """
+        Integrates over the duration dt in nt steps and appends the new states to the history.
+        """
+        if integrator is None:
+            integrator = self.integrator
+        if integrator not in self.integrators:
+            raise ValueError(f"Unknown integrator {integrator!r}.")
+        state = self._state
+        t0 = self.t
+        if integrator == "odeint":
+            time = np.linspace(0.0, dt, nt + 1)
+            Xs = odeint(self.derivative, state, time)
+            self._append(Xs[1:], t0 + time[1:])
+            state[:] = Xs[-1]
+        else:
+            step = getattr(self, f"_step_{integrator}")
+            h = dt / nt
+            # Velocity Verlet starts from the acceleration of the current state, recomputed as
+            # the forces, masses or state may have changed since the last solve.
+            if integrator == "verlet":
+                self._A[:] = self.acceleration(*self.split_state(state))
+            for k in range(nt):
+                step(state, k * h, h)
+                self._step += 1
+                if self._step % self.decimation == 0:
+                    self._cursor = (self._cursor + 1) % self.nk
+                    self._X[self._cursor] = state
+                    self._filled = min(self._filled + 1, self.nk)
+                    if self._writer is not None:
+                        self._write(state[np.newaxis], [t0 + (k + 1) * h])
+        self.t = t0 + dt
+
+    def _append(self, Xs, times):
+        """
+        Appends the consecutive states Xs to the history, keeping one every decimation steps.
+        """
+        steps = self._step + 1 + np.arange(len(Xs))
+        self._step += len(Xs)
+        kept = steps % self.decimation == 0
+        Xs = Xs[kept]
+        if self._writer is not None:
+            self._write(Xs, times[kept])
+        Xs = Xs[-self.nk :]
+        k = len(Xs)
+        rows = (self._cursor + 1 + np.arange(k)) % self.nk
+        self._X[rows] = Xs
+        if k:
+            self._cursor = rows[-1]
+        self._filled = min(self._filled + k, self.nk)
+
+    def history(self, columns=slice(None)):
+        """
+        Returns the kept states, oldest first, restricted to columns: a view if the ring buffer
+        did not wrap yet, else a copy.
+        """
+        X = self._X
+        c = self._cursor + 1
+        if self._filled < self.nk:
+            return X[: self._filled, columns]
+        if c == self.nk:
+            return X[:, columns]
+        return np.concatenate([X[c:, columns], X[:c, columns]])
+
+    X = property(history)
+
+    def get_writer(self):
+        """
+        Returns the attached TrajectoryWriter, if any.
+        """
+        return self._writer
+
+    def set_writer(self, writer):
+        """
+        Attaches a TrajectoryWriter that receives the kept states from now on, starting with the
+        current one.
+        """
+        self._writer = writer
+        if writer is not None:
+            self._write(self._state[np.newaxis], [self.t])
+
+    writer = property(get_writer, set_writer)
+
+    def _write(self, Xs, times):
+        """
+        Sends the states Xs at times to the writer, with their energies if it stores them.
+        """
+        energies = None
+        if self._writer.energies:
+            energies = [self.energies(X) for X in Xs]
+        self._writer.write(Xs, times, energies)
+
+    def energies(self, state=None):
+        """
+        Returns the kinetic and potential energies of a state, the current one by default: a
+        (2,) array, (K, 2) for a PMDEnsemble. The potential is given by the potential(P) method
+        of a subclass that defines one, else by total_potential.
+        """
+        if state is None:
+            state = self._state
+        P, V = self.split_state(state)
+        kinetic = 0.5 * (self._m * (V**2).sum(axis=-1)).sum(axis=-1)
+        potential = getattr(self, "potential", self.total_potential)
+        return np.stack([kinetic, potential(P)], axis=-1)
+
+    def add_force(self, force):
+        """
+        Attaches a MetaForce to the force field of derivative and acceleration.
+        """
+        force.set_master(self)
+        self.forces.append(force)
+        return force
+
+    def get_pair_cutoff(self):
+        """
+        Returns the cutoff of the pair geometry shared by the attached pair forces: the
+        largest one, inf if a force needs all the pairs, None without pair forces.
+        """
+        cutoffs = [force.cutoff for force in self.forces if force.needs_pairs]
+        if not cutoffs:
+            return None
+        if None in cutoffs:
+            return np.inf
+        return max(cutoffs)
+
+    def get_shared_pairs(self, P):
+        """
+        Returns the pair geometry (i, j, dx, dy, r) shared by the attached pair forces.
 
-    def solve(self, dt, nt):
-        time = np.linspace(0.0, dt, nt + 1)
-        Xs = odeint(self.derivative, self.X[-1], time)
-        nk = self.nk
-        X = self.X
-        X[: nk - nt] = X[nt:]
-        X[-nt - 1 :] = Xs
-        self.X = X
+        The pair force of largest cutoff sets the search: its own neighbor list if it has one
+        (MorseForce with skin), or else the PMD list with its method and the default skin.
+        """
+        cutoff = self.get_pair_cutoff()
+        if cutoff is None:
+            return None
+        if cutoff == np.inf:
+            if self._all_pairs is None:
+                self._all_pairs = np.triu_indices(self._n, 1)
+            return all_pairs(P, self._all_pairs)
+        force = next(f for f in self.forces if f.needs_pairs and f.cutoff == cutoff)
+        if getattr(force, "neighbor_list", None) is not None:
+            return force.neighbor_list(P)
+        return self.get_pairs(P, cutoff, method=getattr(force, "method", "cells"))
+
+    def _force_calls(self, P):
+        """
+        Yields the attached forces and their keyword arguments, the pair geometry being
+        computed once and restricted to the cutoff of each pair force.
+        """
+        data = self.get_shared_pairs(P)
+        for force in self.forces:
+            if not force.needs_pairs:
+                yield force, {}
+                continue
+            force_data = data
+            if force.cutoff is not None and force.cutoff < self.get_pair_cutoff():
+                keep = data[4] < force.cutoff
+                force_data = tuple(a[keep] for a in data)
+            yield force, {"pairs_data": force_data}
+
+    def total_force(self, P, V):
+        """
+        Returns the (n, 2) sum of the attached forces.
+        """
+        F = np.zeros((self._n, 2))
+        for force, kwargs in self._force_calls(P):
+            F += force.force(P, V, **kwargs)
+        return F
+
+    def total_potential(self, P):
+        """
+        Returns the potential energy of the attached forces that have one.
+        """
+        return sum(
+            force.potential(P, **kwargs)
+            for force, kwargs in self._force_calls(P)
+            if hasattr(force, "potential")
+        )
+
+    def derivative(self, X, t):
+        """
+        Returns the state derivative of the attached forces. Subclasses can override it.
+        """
+        P, V = self.split_state(X)
+        return self.state_derivative(V, self.total_force(P, V))
+
+    def acceleration(self, P, V, t=0.0):
+        """
+        Returns the (n, 2) accelerations: those of the attached forces, or else extracted from
+        derivative. Subclasses can override this method to avoid its copies.
+        """
+        if type(self).derivative is PMD.derivative:
+            return self.total_force(P, V) / self._m[..., np.newaxis]
+        return self.split_state(self.derivative(self.pack_state(P, V), t))[1]
+
+    def _step_verlet(self, state, t, h):
+        P, V = self.split_state(state)
+        A = self._A
+        V += 0.5 * h * A
+        P += h * V
+        # The velocity dependent forces see the half step velocities.
+        A[:] = self.acceleration(P, V, t + h)
+        V += 0.5 * h * A
+
+    def _step_leapfrog(self, state, t, h):
+        P, V = self.split_state(state)
+        P += 0.5 * h * V
+        V += h * self.acceleration(P, V, t + 0.5 * h)
+        P += 0.5 * h * V
+
+    def _step_yoshida4(self, state, t, h):
+        P, V = self.split_state(state)
+        for c, d in zip(YOSHIDA_C[:3], YOSHIDA_D):
+            P += c * h * V
+            t += c * h
+            V += d * h * self.acceleration(P, V, t)
+        P += YOSHIDA_C[3] * h * V
+
+    def get_m(self):
+        """
+        Returns the masses.
+        """
+        return self._m
+
+    def set_m(self, m):
+        """
+        Sets the masses and clears the cached mass products.
+        """
+        self._m = np.array(m)
+        self._M = None
+
+    m = property(get_m, set_m)
+
+    def get_M(self):
+        """
+        Returns the (n, n) mass products m[a] * m[b], cached until m is set again.
+        """
+        if self._M is None:
+            self._M = self._m[..., :, np.newaxis] * self._m[..., np.newaxis, :]
+        return self._M
+
+    M = property(get_M)
+
+    def get_workspace(self):
+        """
+        Returns the dense derivative buffers, allocated once from n: D, R, U (see distances),
+        f (n, n) pair intensities and F (n, 2) forces.
+        """
+        if self._workspace is None:
+            n = self._n
+            # Leading batch axes of the positions, see PMDEnsemble.
+            lead = self._A.shape[:-2]
+            self._workspace = {
+                "D": np.empty(lead + (n, n, 2)),
+                "R": np.empty(lead + (n, n)),
+                "U": np.empty(lead + (n, n, 2)),
+                "f": np.empty(lead + (n, n)),
+                "F": np.empty(lead + (n, 2)),
+            }
+        return self._workspace
+
+    workspace = property(get_workspace)
+
+    def state_derivative(self, V, F):
+        """
+        Returns the state derivative [V, F / m] written in a buffer reused at each call.
+        """
+        dP, dV = self.split_state(self._dX)
+        dP[:] = V
+        np.divide(F, self._m[..., np.newaxis], out=dV)
+        return self._dX
+
+    def get_pairs(self, P, cutoff, skin=0.3, method="cells"):
+        """
+        Returns the pairs closer than cutoff as (i, j, dx, dy, r) through a Verlet neighbor list
+        kept between the derivative calls.
+        """
+        nl = self.neighbor_list
+        if nl is None or (nl.cutoff, nl.skin, nl.method) != (cutoff, skin, method):
+            nl = NeighborList(cutoff, skin, method)
+            self.neighbor_list = nl
+        return nl(P)
 
     def get_positions(self):
         """
         Returns the current positions.
         """
-        n = len(self.m)
-        return self.X[-1, : 2 * n].reshape(n, 2)
+        return self.split_state(self._state)[0]
 
     def set_positions(self, P):
         """
         Sets the current positions.
         """
-        n = len(self.m)
-        self.X[-1, : 2 * n] = P.flatten()
+        self.split_state(self._state)[0][:] = P
+        if self._step % self.decimation == 0:
+            self._X[self._cursor] = self._state
 
     positions = property(get_positions, set_positions)
 
@@ -66,27 +558,386 @@ class PMD:
         """
         Returns the current velocities.
         """
-        n = len(self.m)
-        return self.X[-1, 2 * n :].reshape(n, 2)
+        return self.split_state(self._state)[1]
 
     velocities = property(get_velocities)
 
     def xy(self):
         n = self._n
-        p = self.X[-1, : 2 * n].reshape(n, 2)
+        p = self._state[: 2 * n].reshape(n, 2)
         return p[:, 0], p[:, 1]
 
     def trail(self, i):
-        n = self._n
-        X = self.X
+        """
+        Returns the kept positions of the particle i, oldest first.
+        """
+        xy = self.history(slice(2 * i, 2 * i + 2))
+        return xy[:, 0], xy[:, 1]
+
+
+class PMDEnsemble(PMD):
+    """
+    K independent PMD systems of n particles integrated at once: the positions, velocities
+    and forces are (K, n, 2) arrays. Each member keeps the PMD state layout in a (K, 4n) state
+    and its trajectory is a view of the history, see member.
+
+    The forces run over the K systems together: the pair forces give their intensity(r) and
+    pair_potential(r) on the dense (K, n, n) pair geometry, computed once per evaluation in the
+    workspace, and the other forces their force(P, V) and potential(P). Only the forces setting
+    MetaForce.batched are accepted. Per member parameters are (K, 1, 1) arrays, see
+    member_parameter.
+    """
+
+    def __init__(self, m, P, V, nk=1000, integrator="verlet", decimation=1):
+        P = np.asarray(P, dtype=np.float64)
+        self.K = len(P)
+        m = np.array(np.broadcast_to(m, P.shape[:-1]), dtype=np.float64)
+        super().__init__(m, P, V, nk=nk, integrator=integrator, decimation=decimation)
+
+    @staticmethod
+    def member_parameter(values):
+        """
+        Returns per member parameter values shaped to broadcast with the (K, n, n) distances
+        and the (K, n, 2) vectors.
+        """
+        return np.reshape(values, (-1, 1, 1))
+
+    def pack_state(self, P, V):
+        """
+        Returns the flat (K * 4n) state, member k being state.reshape(K, 4n)[k].
+        """
+        K, n = self.K, self._n
+        state = np.zeros((K, 4 * n))
+        state[:, : 2 * n] = np.reshape(P, (K, 2 * n))
+        state[:, 2 * n :] = np.reshape(V, (K, 2 * n))
+        return state.ravel()
+
+    def split_state(self, state):
+        """
+        Returns the (K, n, 2) positions and velocities views of a state vector.
+        """
+        K, n = self.K, self._n
+        S = state.reshape(K, 4 * n)
+        return S[:, : 2 * n].reshape(K, n, 2), S[:, 2 * n :].reshape(K, n, 2)
+
+    def total_force(self, P, V):
+        """
+        Returns the (K, n, 2) sum of the attached forces.
+        """
+        F = np.zeros_like(P)
+        pair_forces = [force for force in self.forces if force.needs_pairs]
+        if pair_forces:
+            ws = self.workspace
+            D, R, U = distances(P, out=(ws["D"], ws["R"], ws["U"]))
+            for force in pair_forces:
+                f = force.intensity(R)
+                if force.cutoff is not None:
+                    f = np.where(R < force.cutoff, f, 0.0)
+                F += central_forces(f, U, out=ws["F"])
+        for force in self.forces:
+            if not force.needs_pairs:
+                F += force.force(P, V)
+        return F
+
+    def add_force(self, force):
+        """
+        Attaches a MetaForce that supports the batched positions, see MetaForce.batched.
+        """
+        if not force.batched:
+            raise ValueError(f"{type(force).__name__} does not support PMD ensembles.")
+        return super().add_force(force)
+
+    def total_potential(self, P):
+        """
+        Returns the (K,) potential energies of the members, each pair counted once.
+        """
+        E = np.zeros(self.K)
+        pair_forces = [force for force in self.forces if force.needs_pairs]
+        if pair_forces:
+            ws = self.workspace
+            D, R, U = distances(P, out=(ws["D"], ws["R"], ws["U"]))
+            upper = np.triu(np.ones((self._n, self._n), dtype=bool), 1)
+            for force in pair_forces:
+                mask = upper if force.cutoff is None else upper & (R < force.cutoff)
+                E += np.where(mask, force.pair_potential(R), 0.0).sum(axis=(-2, -1))
+        for force in self.forces:
+            if not force.needs_pairs and hasattr(force, "potential"):
+                E += force.potential(P)
+        return E
+
+    def _write(self, Xs, times):
+        self._writer.members = self.K
+        super()._write(Xs, times)
+
+    def member(self, k):
+        """
+        Returns the kept states of the member k, oldest first, in the PMD layout: a view if the
+        ring buffer did not wrap yet.
+        """
+        return self.history().reshape(-1, self.K, 4 * self._n)[:, k]
+
+    def xy(self, member=0):
+        p = self.positions[member]
+        return p[:, 0], p[:, 1]
+
+    def trail(self, i, member=0):
+        """
+        Returns the kept positions of the particle i of a member, oldest first.
+        """
+        X = self.member(member)
         return X[:, 2 * i], X[:, 2 * i + 1]
 
 
+class TrajectoryWriter:
+    """
+    A trajectory sink for PMD.writer: the kept states (PMD layout), their time and, if
+    energies, their kinetic and potential energies are appended to chunks of chunk_size frames
+    in the directory path, listed in its index.json. A PMDEnsemble records its number of
+    members K, the states of its K members being read back apart.
+
+    The "npy" chunks are preallocated memory-mapped files written in place, the "npz" chunks are
+    buffered in memory and saved compressed once full. See TrajectoryReader.
+    """
+
+    def __init__(self, path, chunk_size=100000, file_format="npy", energies=False):
+        if file_format not in ("npy", "npz"):
+            raise ValueError(f"Unknown file format {file_format!r}.")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.file_format = file_format
+        self.energies = energies
+        self.width = None
+        self.energy_shape = None
+        self.members = None
+        self.frames = 0
+        self.chunks = []
+        self._buffers = None
+
+    def _shapes(self):
+        shapes = {"state": (self.chunk_size, self.width), "time": (self.chunk_size,)}
+        if self.energies:
+            shapes["energy"] = (self.chunk_size,) + self.energy_shape
+        return shapes
+
+    def _open_chunk(self):
+        k = len(self.chunks)
+        if self.file_format == "npy":
+            self._maps = [
+                np.lib.format.open_memmap(
+                    chunk_file(self.path, name, k), mode="w+", shape=shape
+                )
+                for name, shape in self._shapes().items()
+            ]
+            # Plain array views, as writing through np.memmap slices is several times slower.
+            self._buffers = dict(
+                zip(self._shapes(), (m.view(np.ndarray) for m in self._maps))
+            )
+        else:
+            self._buffers = {
+                name: np.empty(shape) for name, shape in self._shapes().items()
+            }
+        self.chunks.append({"start": self.frames, "count": 0})
+
+    def write(self, states, times, energies=None):
+        """
+        Appends the (k, width) states at the (k,) times, with their (k, 2) energies, (k, K, 2)
+        for a PMDEnsemble.
+        """
+        states = np.atleast_2d(states)
+        data = {"state": states, "time": np.asarray(times, dtype=np.float64)}
+        if self.energies:
+            energies = np.asarray(energies, dtype=np.float64)
+            if self.energy_shape is None:
+                self.energy_shape = energies.shape[1:]
+            data["energy"] = energies.reshape((-1,) + self.energy_shape)
+        if self.width is None:
+            self.width = states.shape[1]
+        done = 0
+        while done < len(states):
+            if self._buffers is None:
+                self._open_chunk()
+            chunk = self.chunks[-1]
+            c = chunk["count"]
+            k = min(len(states) - done, self.chunk_size - c)
+            for name, buffer in self._buffers.items():
+                buffer[c : c + k] = data[name][done : done + k]
+            chunk["count"] += k
+            self.frames += k
+            done += k
+            if chunk["count"] == self.chunk_size:
+                self.close()
+
+    def flush(self):
+        """
+        Writes the current chunk and the index to disk.
+        """
+        if self._buffers is not None:
+            k = len(self.chunks) - 1
+            if self.file_format == "npy":
+                for m in self._maps:
+                    m.flush()
+            else:
+                count = self.chunks[-1]["count"]
+                np.savez_compressed(
+                    chunk_file(self.path, "chunk", k, "npz"),
+                    **{name: buffer[:count] for name, buffer in self._buffers.items()},
+                )
+        index = {
+            "width": self.width,
+            "frames": self.frames,
+            "chunk_size": self.chunk_size,
+            "file_format": self.file_format,
+            "energies": self.energies,
+            "energy_shape": self.energy_shape,
+            "members": self.members,
+            "chunks": self.chunks,
+        }
+        with open(os.path.join(self.path, "index.json"), "w") as f:
+            json.dump(index, f)
+
+    def close(self):
+        """
+        Flushes and releases the current chunk, the next writes starting a new one.
+        """
+        self.flush()
+        self._buffers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def chunk_file(path, name, k, file_format="npy"):
+    """
+    Returns the file of the chunk k of a trajectory directory.
+    """
+    return os.path.join(path, f"{name}_{k:05d}.{file_format}")
+
+
+class TrajectoryReader:
+    """
+    A lazy reader of a TrajectoryWriter directory: only the chunks holding the requested frames
+    are read, the "npy" ones being memory-mapped. Frames are given as a slice, an index or an
+    array of indices.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self.index = json.load(f)
+        self.width = self.index["width"]
+        self.members = self.index.get("members")
+        self.n = self.width // (4 * (self.members or 1))
+        self.frames = self.index["frames"]
+        self.energy_shape = tuple(self.index.get("energy_shape") or (2,))
+        self._starts = np.array([chunk["start"] for chunk in self.index["chunks"]])
+        self._npz = (None, None)
+
+    def __len__(self):
+        return self.frames
+
+    def chunk(self, name, k):
+        """
+        Returns the name array ("state", "time" or "energy") of the chunk k.
+        """
+        count = self.index["chunks"][k]["count"]
+        if self.index["file_format"] == "npy":
+            return np.load(chunk_file(self.path, name, k), mmap_mode="r")[:count]
+        if self._npz[0] != k:
+            with np.load(chunk_file(self.path, "chunk", k, "npz")) as data:
+                self._npz = (k, {key: data[key] for key in data.files})
+        return self._npz[1][name][:count]
+
+    def read(self, name, frames=slice(None), columns=slice(None)):
+        """
+        Returns the frames of the name array, restricted to columns for "state" and "energy".
+        """
+        if isinstance(frames, slice):
+            frames = np.arange(*frames.indices(self.frames))
+        frames = np.asarray(frames)
+        scalar = frames.ndim == 0
+        frames = np.atleast_1d(frames)
+        frames = np.where(frames < 0, frames + self.frames, frames)
+        which = np.searchsorted(self._starts, frames, side="right") - 1
+        out = None
+        for k in np.unique(which):
+            selected = which == k
+            data = self.chunk(name, k)
+            rows = frames[selected] - self._starts[k]
+            values = data[rows] if data.ndim == 1 else data[rows][:, columns]
+            if out is None:
+                out = np.empty((len(frames),) + values.shape[1:])
+            out[selected] = values
+        if out is None:
+            shape = {"state": (self.width,), "energy": self.energy_shape}.get(name, ())
+            out = np.empty((0,) + tuple(shape))
+            if shape:
+                out = out[:, columns]
+        return out[0] if scalar else out
+
+    def _columns(self, particles, offset):
+        n = self.n
+        columns = (offset + np.arange(2 * n).reshape(n, 2)[particles]).ravel()
+        if self.members is None:
+            return columns
+        return (4 * n * np.arange(self.members)[:, np.newaxis] + columns).ravel()
+
+    def _vectors(self, X):
+        if self.members is None:
+            return X.reshape(X.shape[:-1] + (X.shape[-1] // 2, 2))
+        K = self.members
+        return X.reshape(X.shape[:-1] + (K, X.shape[-1] // (2 * K), 2))
+
+    def states(self, frames=slice(None)):
+        return self.read("state", frames)
+
+    def positions(self, frames=slice(None), particles=slice(None)):
+        """
+        Returns the (frames, particles, 2) positions, (frames, K, particles, 2) for a
+        PMDEnsemble.
+        """
+        return self._vectors(self.read("state", frames, self._columns(particles, 0)))
+
+    def velocities(self, frames=slice(None), particles=slice(None)):
+        """
+        Returns the (frames, particles, 2) velocities, (frames, K, particles, 2) for a
+        PMDEnsemble.
+        """
+        return self._vectors(
+            self.read("state", frames, self._columns(particles, 2 * self.n))
+        )
+
+    def time(self, frames=slice(None)):
+        return self.read("time", frames)
+
+    def energies(self, frames=slice(None)):
+        """
+        Returns the (frames, 2) kinetic and potential energies, (frames, K, 2) for a
+        PMDEnsemble, if they were written.
+        """
+        return self.read("energy", frames)
+
+
 class MetaForce:
     """
     A force metaclass to rule them all
+
+    A force defines force(P, V) and optionally potential(P). A pair force sets needs_pairs and
+    its cutoff (None for all the pairs) and also accepts the pairs_data=(i, j, dx, dy, r)
+    keyword, so that a PMD instance computes the pair geometry once for all its forces.
+
+    A force sets batched if it works on the (K, n, 2) positions of a PMDEnsemble: force and
+    potential then return (K, n, 2) and (K,) arrays, and a pair force gives intensity(r) and
+    pair_potential(r) on distance arrays of any shape.
     """
 
+    needs_pairs = False
+    batched = False
+    cutoff = None
+
     def set_master(self, master):
         """
         Sets the PMD instance to work with
@@ -98,3 +949,549 @@ class MetaForce:
 
     def master_potential(self):
         return self.potential(P=self.master.positions)
+
+
+class MorseForce(MetaForce):
+    """
+    Morse pair force computed on the pairs closer than cutoff, using a Verlet neighbor list if
+    skin is given.
+    """
+
+    needs_pairs = True
+    batched = True
+
+    def __init__(
+        self,
+        De=1.0,
+        a=1.0,
+        re=1.0,
+        cutoff=None,
+        method="cells",
+        cutoff_radius=1.0e-2,
+        skin=None,
+    ):
+        self.De = De
+        self.a = a
+        self.re = re
+        if cutoff is None:
+            cutoff = re + 10.0 / a
+        self.cutoff = cutoff
+        self.method = method
+        self.cutoff_radius = cutoff_radius
+        self.neighbor_list = None
+        if skin is not None:
+            self.neighbor_list = NeighborList(cutoff, skin, method)
+
+    def get_pairs(self, P):
+        """
+        Returns the pairs closer than cutoff.
+        """
+        if self.neighbor_list is None:
+            return pairs(P, self.cutoff, self.method)
+        return self.neighbor_list(P)
+
+    def intensity(self, r):
+        """
+        Returns the pair force intensity (positive = attractive).
+        """
+        De, a, re = self.De, self.a, self.re
+        e = np.exp(-a * (np.maximum(r, self.cutoff_radius) - re))
+        return 2.0 * De * a * (1.0 - e) * e
+
+    def pair_potential(self, r):
+        """
+        Returns the pair potential energy, shifted by -De to vanish at infinity.
+        """
+        return self.De * ((1.0 - np.exp(-self.a * (r - self.re))) ** 2 - 1.0)
+
+    def force(self, P, V=None, pairs_data=None):
+        """
+        Returns the (n, 2) Morse forces, pairs_data being the output of pairs if already known.
+        """
+        if pairs_data is None:
+            pairs_data = self.get_pairs(P)
+        i, j, dx, dy, r = pairs_data
+        return pair_sum(len(P), i, j, dx, dy, r, self.intensity(r))
+
+    def potential(self, P, pairs_data=None):
+        """
+        Returns the potential energy of the pairs closer than cutoff, the Morse potential being
+        shifted by -De to vanish at infinity.
+        """
+        if pairs_data is None:
+            pairs_data = self.get_pairs(P)
+        return self.pair_potential(pairs_data[4]).sum()
+
+
+def direct_gravity(P, m, G=1.0, cutoff_radius=1.0e-2, targets=None, batch_size=1024):
+    """
+    Returns the (len(targets), 2) gravity forces on the targets (default all) by direct
+    summation, the distances being bounded below by cutoff_radius as in Gravity.derivative.
+    """
+    P = np.asarray(P, dtype=np.float64)
+    m = np.asarray(m, dtype=np.float64)
+    if targets is None:
+        targets = np.arange(len(P))
+    F = np.zeros((len(targets), 2))
+    for start in range(0, len(targets), batch_size):
+        t = targets[start : start + batch_size]
+        D = P - P[t, np.newaxis]
+        R = np.sqrt((D**2).sum(axis=2))
+        f = np.divide(
+            m,
+            R * np.maximum(R, cutoff_radius) ** 2,
+            out=np.zeros_like(R),
+            where=R != 0.0,
+        )
+        F[start : start + batch_size] = (f[:, :, np.newaxis] * D).sum(axis=1)
+    return G * m[targets, np.newaxis] * F
+
+
+class BarnesHutGravity(MetaForce):
+    """
+    Barnes-Hut quadtree gravity: a cell seen under an angle size / distance smaller than theta
+    acts as a point mass at its center of mass, the leaves are summed directly.
+    The tree is built level by level and the particles are processed in batches.
+    """
+
+    def __init__(
+        self,
+        G=1.0,
+        theta=0.5,
+        leaf_size=8,
+        cutoff_radius=1.0e-2,
+        batch_size=4096,
+        max_level=30,
+    ):
+        self.G = G
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self.cutoff_radius = cutoff_radius
+        self.batch_size = batch_size
+        self.max_level = max_level
+
+    def build(self, P, m):
+        """
+        Builds the quadtree: for each level, the sorted node keys, masses, centers of mass,
+        leaf flags, the ranges of their particles in a sorted particle list and the node of
+        each particle (-1 if it is in a leaf of an upper level).
+        """
+        P = np.asarray(P, dtype=np.float64)
+        lo = P.min(axis=0)
+        size = (P.max(axis=0) - lo).max() * (1.0 + 1.0e-9)
+        if size == 0.0:
+            size = 1.0
+        u = (P - lo) / size
+        levels = []
+        active = np.arange(len(P))
+        for level in range(self.max_level + 1):
+            k = 2**level
+            ix, iy = np.minimum((u[active] * k).astype(np.int64), k - 1).T
+            keys, inv, counts = np.unique(
+                ix * k + iy, return_inverse=True, return_counts=True
+            )
+            mass = np.bincount(inv, m[active])
+            safe = np.where(mass > 0.0, mass, 1.0)
+            cx = np.bincount(inv, m[active] * P[active, 0]) / safe
+            cy = np.bincount(inv, m[active] * P[active, 1]) / safe
+            leaf = counts <= self.leaf_size
+            if level == self.max_level:
+                leaf[:] = True
+            order = np.argsort(inv, kind="stable")
+            node = np.full(len(P), -1, dtype=np.int64)
+            node[active] = inv
+            levels.append(
+                {
+                    "keys": keys,
+                    "mass": mass,
+                    "cx": cx,
+                    "cy": cy,
+                    "leaf": leaf,
+                    "size": size / k,
+                    "members": active[order],
+                    "start": np.cumsum(counts) - counts,
+                    "count": counts,
+                    "node": node,
+                }
+            )
+            active = active[~leaf[inv]]
+            if active.size == 0:
+                break
+        self.levels = levels
+        return levels
+
+    def _accelerations(self, P, m, batch):
+        """
+        Returns the accelerations / G of the particles of batch, walking the tree level by
+        level with a frontier of (particle, node) pairs.
+        """
+        theta, c = self.theta, self.cutoff_radius
+        nb = len(batch)
+        ax = np.zeros(nb)
+        ay = np.zeros(nb)
+        p = np.arange(nb)
+        q = np.zeros(nb, dtype=np.int64)
+        for level, lev in enumerate(self.levels):
+            if p.size == 0:
+                break
+            i = batch[p]
+            dx = lev["cx"][q] - P[i, 0]
+            dy = lev["cy"][q] - P[i, 1]
+            d = np.sqrt(dx**2 + dy**2)
+            # A cell containing the particle is never approximated.
+            inside = lev["node"][i] == q
+            accept = (lev["size"] < theta * d) & ~inside
+            f = lev["mass"][q[accept]] / (d[accept] * np.maximum(d[accept], c) ** 2)
+            ax += np.bincount(p[accept], f * dx[accept], minlength=nb)
+            ay += np.bincount(p[accept], f * dy[accept], minlength=nb)
+
+            # Leaves: direct sums with their particles.
+            leaf = ~accept & lev["leaf"][q]
+            pl, ql = p[leaf], q[leaf]
+            counts = lev["count"][ql]
+            pp = np.repeat(pl, counts)
+            offsets = np.repeat(lev["start"][ql] - np.cumsum(counts) + counts, counts)
+            j = lev["members"][offsets + np.arange(counts.sum())]
+            i = batch[pp]
+            dx = P[j, 0] - P[i, 0]
+            dy = P[j, 1] - P[i, 1]
+            d = np.sqrt(dx**2 + dy**2)
+            f = np.divide(
+                m[j], d * np.maximum(d, c) ** 2, out=np.zeros_like(d), where=d != 0.0
+            )
+            ax += np.bincount(pp, f * dx, minlength=nb)
+            ay += np.bincount(pp, f * dy, minlength=nb)
+
+            # Opened cells: the frontier moves to their children.
+            opened = ~accept & ~lev["leaf"][q]
+            if level + 1 == len(self.levels):
+                break
+            po, qo = p[opened], q[opened]
+            k = 2**level
+            ckeys = self.levels[level + 1]["keys"]
+            pkx, pky = np.divmod(lev["keys"][qo], k)
+            new_p, new_q = [], []
+            for sx, sy in ((0, 0), (0, 1), (1, 0), (1, 1)):
+                key = (2 * pkx + sx) * 2 * k + 2 * pky + sy
+                pos = np.minimum(np.searchsorted(ckeys, key), len(ckeys) - 1)
+                exists = ckeys[pos] == key
+                new_p.append(po[exists])
+                new_q.append(pos[exists])
+            p = np.concatenate(new_p)
+            q = np.concatenate(new_q)
+        return np.array([ax, ay]).T
+
+    def force(self, P, V=None, m=None):
+        """
+        Returns the (n, 2) gravity forces, the masses defaulting to the master ones.
+        """
+        if m is None:
+            m = self.master.m
+        P = np.asarray(P, dtype=np.float64)
+        m = np.asarray(m, dtype=np.float64)
+        self.build(P, m)
+        A = np.empty((len(P), 2))
+        for start in range(0, len(P), self.batch_size):
+            batch = np.arange(start, min(start + self.batch_size, len(P)))
+            A[batch] = self._accelerations(P, m, batch)
+        return self.G * m[:, np.newaxis] * A
+
+    def accuracy(self, P, m=None, sample=1000, seed=0):
+        """
+        Compares the forces on a random sample of particles with the direct sum and returns
+        the relative errors statistics.
+        """
+        if m is None:
+            m = self.master.m
+        F = self.force(P, m=m)
+        rng = np.random.default_rng(seed)
+        targets = np.sort(rng.choice(len(P), min(sample, len(P)), replace=False))
+        Fd = direct_gravity(P, m, self.G, self.cutoff_radius, targets)
+        norm = np.sqrt((Fd**2).sum(axis=1))
+        err = np.sqrt(((F[targets] - Fd) ** 2).sum(axis=1)) / np.where(
+            norm > 0, norm, 1.0
+        )
+        return {
+            "theta": self.theta,
+            "sample": len(targets),
+            "median": float(np.median(err)),
+            "p99": float(np.percentile(err, 99)),
+            "max": float(err.max()),
+            "rms": float(np.sqrt((err**2).mean())),
+        }
+
+
+class GravityForce(MetaForce):
+    """
+    Direct pair gravity G m_i m_j / r^2, r being bounded below by cutoff_radius as in the
+    gravity.ipynb model.
+    """
+
+    needs_pairs = True
+    batched = True
+
+    def __init__(self, G=1.0, cutoff_radius=1.0e-2):
+        self.G = G
+        self.cutoff_radius = cutoff_radius
+
+    def intensity(self, r):
+        """
+        Returns the dense pair force intensities G M / r^2 on the (..., n, n) distances, M being
+        the master mass products.
+        """
+        return self.G * self.master.M / np.maximum(r, self.cutoff_radius) ** 2
+
+    def pair_potential(self, r):
+        """
+        Returns the dense pair potential energies -G M / r on the (..., n, n) distances.
+        """
+        return -self.G * self.master.M / np.maximum(r, self.cutoff_radius)
+
+    def force(self, P, V=None, pairs_data=None, m=None):
+        """
+        Returns the (n, 2) gravity forces, the masses defaulting to the master ones.
+        """
+        if m is None:
+            m = self.master.m
+        if pairs_data is None:
+            pairs_data = all_pairs(P)
+        i, j, dx, dy, r = pairs_data
+        f = self.G * m[i] * m[j] / np.maximum(r, self.cutoff_radius) ** 2
+        return pair_sum(len(P), i, j, dx, dy, r, f)
+
+    def potential(self, P, pairs_data=None, m=None):
+        """
+        Returns the gravity potential energy.
+        """
+        if m is None:
+            m = self.master.m
+        if pairs_data is None:
+            pairs_data = all_pairs(P)
+        i, j, r = pairs_data[0], pairs_data[1], pairs_data[4]
+        return -(self.G * m[i] * m[j] / np.maximum(r, self.cutoff_radius)).sum()
+
+
+class DragForce(MetaForce):
+    """
+    Drag force -mu |V|^(exponent - 1) V.
+    """
+
+    batched = True
+
+    def __init__(self, mu=1.0, exponent=1.0):
+        self.mu = mu
+        self.exponent = exponent
+
+    def force(self, P, V):
+        if self.exponent == 1.0:
+            return -self.mu * V
+        v = np.sqrt((V**2).sum(axis=-1))[..., np.newaxis]
+        return -self.mu * v ** (self.exponent - 1.0) * V
+
+
+class ConstantField(MetaForce):
+    """
+    Uniform external field: the force m g.
+    """
+
+    batched = True
+
+    def __init__(self, g=(0.0, -9.81)):
+        self.g = np.array(g, dtype=np.float64)
+
+    def force(self, P, V):
+        return self.master.m[..., np.newaxis] * self.g
+
+    def potential(self, P):
+        return -(self.master.m * (P @ self.g)).sum(axis=-1)
+
+
+class SpringForce(MetaForce):
+    """
+    Linear springs of stiffness k and free length l0 between the particles i and j.
+    """
+
+    def __init__(self, i, j, k=1.0, l0=1.0):
+        self.i = np.asarray(i)
+        self.j = np.asarray(j)
+        self.k = k
+        self.l0 = l0
+
+    def force(self, P, V):
+        i, j, dx, dy, r = all_pairs(P, (self.i, self.j))
+        return pair_sum(len(P), i, j, dx, dy, r, self.k * (r - self.l0))
+
+    def potential(self, P):
+        r = all_pairs(P, (self.i, self.j))[4]
+        return (0.5 * self.k * (r - self.l0) ** 2).sum()
+
+
+class TabulatedPairForce(MetaForce):
+    """
+    Pair force of any potential V(r), tabulated once over [r_min, cutoff] and evaluated by
+    linear or cubic interpolation.
+
+    The potential is a callable or a sympy expression of one symbol, the force -dV/dr
+    (positive = repulsive) being derived from it if not given. Below r_min, the distances
+    are bounded to r_min. With shift, the potential is shifted to vanish at the cutoff.
+    """
+
+    needs_pairs = True
+    batched = True
+
+    def __init__(
+        self,
+        potential,
+        cutoff,
+        r_min=1.0e-2,
+        force=None,
+        resolution=2048,
+        kind="linear",
+        shift=True,
+        symbol=None,
+    ):
+        if kind not in ("linear", "cubic"):
+            raise ValueError(f"Unknown interpolation kind {kind!r}.")
+        if hasattr(potential, "free_symbols"):
+            potential, force = self._lambdify(potential, symbol)
+        if force is None:
+            force = self._numerical_force(potential, cutoff - r_min)
+        self.potential_function = potential
+        self.force_function = force
+        self.cutoff = cutoff
+        self.r_min = r_min
+        self.resolution = resolution
+        self.kind = kind
+        self.r = np.linspace(r_min, cutoff, resolution)
+        self.dr = self.r[1] - self.r[0]
+        self._x = np.empty(0)
+        self._k = np.empty(0, dtype=np.intp)
+        self._c = np.empty(0)
+        self._f = np.empty(0)
+        V = potential(self.r) * np.ones_like(self.r)
+        self.V_shift = V[-1] if shift else 0.0
+        # The pair_sum intensities are dV/dr (positive = attractive).
+        self.V_table = self._table(V - self.V_shift)
+        self.f_table = self._table(-force(self.r) * np.ones_like(self.r))
+
+    @staticmethod
+    def _lambdify(expression, symbol):
+        import sympy as sp
+
+        if symbol is None:
+            (symbol,) = expression.free_symbols
+        potential = sp.lambdify(symbol, expression, ["scipy", "numpy"])
+        force = sp.lambdify(symbol, -expression.diff(symbol), ["scipy", "numpy"])
+        return potential, force
+
+    @staticmethod
+    def _numerical_force(potential, scale):
+        h = 1.0e-6 * scale
+        return lambda r: -(potential(r + h) - potential(r - h)) / (2.0 * h)
+
+    def _table(self, values):
+        """
+        Returns the polynomial coefficients of each interval in the interval unit, highest
+        degree first: 2 (linear) or 4 (cubic) contiguous arrays.
+        """
+        if self.kind == "linear":
+            return np.diff(values), values[:-1].copy()
+        c = interpolate.CubicSpline(self.r, values).c
+        return tuple(c[d] * self.dr ** (3 - d) for d in range(4))
+
+    def _scratch(self, n):
+        if len(self._x) < n:
+            self._x = np.empty(2 * n)
+            self._k = np.empty(2 * n, dtype=np.intp)
+            self._c = np.empty(2 * n)
+            self._f = np.empty(2 * n)
+        return self._x[:n], self._k[:n], self._c[:n]
+
+    def lookup(self, table, r, out=None):
+        """
+        Returns the table values at the distances r: a gather and a multiply-add per
+        polynomial degree, in reused buffers.
+        """
+        r = np.asarray(r)
+        x, k, ck = self._scratch(r.size)
+        np.subtract(r.reshape(-1), self.r_min, out=x)
+        x *= 1.0 / self.dr
+        np.clip(x, 0.0, self.resolution - 1 - 1.0e-9, out=x)
+        k[:] = x
+        x -= k
+        if out is None:
+            out = np.empty(r.shape)
+        # The flat view of the contiguous out.
+        flat = out.reshape(-1)
+        np.take(table[0], k, out=flat)
+        for c in table[1:]:
+            flat *= x
+            np.take(c, k, out=ck)
+            flat += ck
+        return out
+
+    def intensity(self, r, out=None):
+        """
+        Returns the pair force intensity (positive = attractive).
+        """
+        return self.lookup(self.f_table, r, out)
+
+    def pair_potential(self, r):
+        """
+        Returns the (shifted) pair potential energy.
+        """
+        return self.lookup(self.V_table, r)
+
+    def force(self, P, V=None, pairs_data=None):
+        """
+        Returns the (n, 2) forces, pairs_data being the output of pairs if already known.
+        """
+        if pairs_data is None:
+            pairs_data = pairs(P, self.cutoff)
+        i, j, dx, dy, r = pairs_data
+        self._scratch(len(r))
+        f = self.intensity(r, out=self._f[: len(r)])
+        return pair_sum(len(P), i, j, dx, dy, r, f)
+
+    def potential(self, P, pairs_data=None):
+        """
+        Returns the (shifted) potential energy of the pairs closer than cutoff.
+        """
+        if pairs_data is None:
+            pairs_data = pairs(P, self.cutoff)
+        return self.pair_potential(pairs_data[4]).sum()
+
+    def report(self, samples=100000, repeat=5, seed=0):
+        """
+        Compares the interpolated and exact force and potential on random distances and
+        returns the errors and the evaluation times per pair.
+        """
+        r = np.random.default_rng(seed).uniform(self.r_min, self.cutoff, samples)
+        self._scratch(samples)
+        f_exact = -self.force_function(r)
+        V_exact = self.potential_function(r) - self.V_shift
+        f_scale = np.abs(f_exact).max()
+        V_scale = np.abs(V_exact).max()
+        timings = {}
+        for name, function in (
+            ("exact", lambda: self.force_function(r)),
+            ("table", lambda: self.intensity(r, out=self._f[:samples])),
+        ):
+            durations = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                function()
+                durations.append(time.perf_counter() - t0)
+            timings[name] = 1.0e9 * min(durations) / samples
+        return {
+            "kind": self.kind,
+            "resolution": self.resolution,
+            "force_max_error": float(
+                np.abs(self.intensity(r) - f_exact).max() / f_scale
+            ),
+            "potential_max_error": float(
+                np.abs(self.lookup(self.V_table, r) - V_exact).max() / V_scale
+            ),
+            "exact_ns_per_pair": timings["exact"],
+            "table_ns_per_pair": timings["table"],
+        }